@@ -0,0 +1,184 @@
+"""
+Extractions per song and search-to-playable time of Spotify tracks, with and without SinglePassSearch.
+yt-dlp is replayed from tests/fixtures/extraction.json, each page fetch takes the time stored with its response.
+Run from the repository root: python -m benchmarks.extraction [--record]
+"""
+
+from asyncio import gather, get_running_loop, run
+from contextlib import contextmanager
+from copy import deepcopy
+from itertools import islice
+from json import dump, load
+from pathlib import Path
+from statistics import median
+from sys import argv
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Any, Iterator
+from urllib.parse import quote
+
+from benchmarks.song_memory import REQUESTER
+from config.settings import SETTINGS
+from lib.music.executor import ExtractionExecutor
+from lib.music.extraction import YTDLSource
+
+FIXTURES = Path(__file__).parent.parent / "tests" / "fixtures" / "extraction.json"
+
+ENTRY_KEYS = ('_type', 'ie_key', 'id', 'url', 'title', 'channel', 'channel_id', 'uploader', 'duration', 'view_count')
+INFO_KEYS = YTDLSource.CACHED_KEYS + ('id', 'url', 'ext', 'format_id', 'abr', 'asr')
+
+WORKERS = 4
+REPEAT = 4  # Times each recorded track is requested, e.g. by several guilds
+
+
+class ReplayYoutubeDL:
+    """
+    Answers the calls the bot makes on YoutubeDL from recorded responses.
+    Counts the page fetches and takes as long for each as the recording did, scaled.
+    """
+
+    def __init__(self, fixtures: dict, scale: float = 1.0) -> None:
+        self._fixtures = fixtures
+        self._scale = scale
+        self._lock = Lock()
+        self.fetches = 0
+
+    def _fetch(self, elapsed: float) -> None:
+        with self._lock:
+            self.fetches += 1
+        sleep(elapsed * self._scale)
+
+    def extract_info(self, url: str, download: bool = True, process: bool = True) -> dict:
+        if search := self._fixtures['searches'].get(url):
+            self._fetch(search['elapsed'])
+            entries: list[dict] = deepcopy(search['entries'])
+            if process:
+                return {'_type': 'playlist', 'entries': [self.process_ie_result(entry) for entry in entries]}
+            return {'_type': 'playlist', 'entries': (entry for entry in entries)}
+
+        video: dict = self._fixtures['videos'][url]
+        self._fetch(video['elapsed'])
+        return deepcopy(video['info'])
+
+    def process_ie_result(self, ie_result: dict, download: bool = True) -> dict:
+        if ie_result.get('_type') == 'url':
+            return self.extract_info(ie_result['url'], download)
+        return ie_result
+
+
+class ReplayPool:
+    """A YoutubeDLPool handing out one shared ReplayYoutubeDL, it keeps no per-extraction state."""
+
+    def __init__(self, ytdl: ReplayYoutubeDL) -> None:
+        self._ytdl = ytdl
+
+    @contextmanager
+    def checkout(self) -> Iterator[ReplayYoutubeDL]:
+        yield self._ytdl
+
+
+def load_fixtures() -> dict:
+    with FIXTURES.open() as file:
+        return load(file)
+
+
+@contextmanager
+def replayed(
+        fixtures: dict,
+        single_pass: bool,
+        scale: float = 1.0
+) -> Iterator[tuple[ReplayYoutubeDL, ExtractionExecutor]]:
+    """
+    Replays yt-dlp from the fixtures, with a fresh extraction executor whose jobs can be counted.
+
+    :param fixtures: The recorded responses.
+    :param single_pass: The SinglePassSearch setting to use.
+    :param scale: Factor applied to the recorded time of each page fetch.
+    :return: The replaying YoutubeDL and the executor.
+    """
+
+    ytdl: ReplayYoutubeDL = ReplayYoutubeDL(fixtures, scale)
+    executor: ExtractionExecutor = ExtractionExecutor(WORKERS)
+    previous: tuple[Any, Any, bool] = (
+        YTDLSource.ytdl_pool, YTDLSource.executor, SETTINGS['Music']['SinglePassSearch']
+    )
+    YTDLSource.ytdl_pool, YTDLSource.executor = ReplayPool(ytdl), executor
+    SETTINGS['Music']['SinglePassSearch'] = single_pass
+    try:
+        yield ytdl, executor
+    finally:
+        YTDLSource.ytdl_pool, YTDLSource.executor, SETTINGS['Music']['SinglePassSearch'] = previous
+        executor.shutdown()
+
+
+async def search_to_playable(tracks: list[dict]) -> list[float]:
+    """
+    Resolves Spotify tracks concurrently, as a queued playlist is prefetched.
+
+    :param tracks: The name, artists and duration of each track.
+    :return: The seconds until the stream URL of each track was known.
+    """
+
+    async def resolve(track: dict) -> float:
+        start: float = perf_counter()
+        await YTDLSource.from_spotify(
+            REQUESTER, "", track['name'], track['artists'], track['duration'], get_running_loop()
+        )
+        return perf_counter() - start
+
+    return await gather(*(resolve(track) for track in tracks))
+
+
+def record() -> None:
+    """
+    Records the search pages and the extractions of their results for the tracks of the fixtures, with yt-dlp.
+    Needs network access, the recorded responses replace the fixtures.
+    """
+
+    fixtures: dict = load_fixtures()
+    searches: dict[str, dict] = {}
+    videos: dict[str, dict] = {}
+    with YTDLSource.ytdl_pool.checkout() as ytdl:
+        for track in fixtures['tracks']:
+            url: str = YTDLSource.SEARCH_URL.format(quote(f"{track['name']} {track['artists']}"))
+            start: float = perf_counter()
+            data: dict = ytdl.extract_info(url, download=False, process=False)
+            entries: list[dict] = list(islice(filter(None, data['entries']), YTDLSource.SEARCH_RESULTS))
+            searches[url] = {
+                'elapsed': round(perf_counter() - start, 3),
+                'entries': [{key: entry.get(key) for key in ENTRY_KEYS} for entry in entries]
+            }
+
+            for entry in entries:
+                start = perf_counter()
+                info: dict = ytdl.process_ie_result(entry, download=False)
+                videos[entry['url']] = {
+                    'elapsed': round(perf_counter() - start, 3),
+                    'info': {key: info.get(key) for key in INFO_KEYS if key != 'thumbnails'}
+                }
+
+    with FIXTURES.open("w") as file:
+        dump({'tracks': fixtures['tracks'], 'searches': searches, 'videos': videos}, file, indent=1)
+
+
+async def main() -> None:
+    fixtures: dict = load_fixtures()
+    tracks: list[dict] = fixtures['tracks'] * REPEAT
+
+    print(f"{len(tracks)} Spotify tracks resolved at once, {WORKERS} extraction workers, fetch times of the fixtures")
+    print(f"{'':<20}{'jobs/song':>11}{'fetches/song':>14}{'median s':>10}{'max s':>8}")
+    for name, single_pass in (("Two jobs", False), ("SinglePassSearch", True)):
+        with replayed(fixtures, single_pass) as (ytdl, executor):
+            timings: list[float] = await search_to_playable(tracks)
+            jobs: int = executor._dispatched
+        print(
+            f"{name:<20}{jobs / len(tracks):>11.1f}{ytdl.fetches / len(tracks):>14.1f}"
+            f"{median(timings):>10.2f}{max(timings):>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    if "--record" in argv:
+        record()
+    else:
+        run(main())
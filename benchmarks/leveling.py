@@ -0,0 +1,62 @@
+"""
+Leveling messages handled per second against a SQLite file, with buffered writes and with a commit per message.
+Run from the repository root: python -m benchmarks.leveling
+"""
+
+from asyncio import get_running_loop, run, sleep
+from pathlib import Path
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from lib.db.database import Database
+from lib.db.db_classes import LevelingStats
+
+MESSAGES = 5000
+USERS = 1000
+GUILDS = 10
+
+
+async def open_database(path: Path, **kwargs) -> Database:
+    database: Database = Database(path, get_running_loop(), **kwargs)
+    while database._db is None:  # Connected in the background
+        await sleep(0.01)
+    return database
+
+
+async def handle_messages(database: Database, messages: int = MESSAGES) -> float:
+    """
+    Handles messages as the leveling cog does, reading and writing the stats of each author.
+
+    :return: Messages per second, including the final flush.
+    """
+
+    rng: Random = Random(0)
+    start: float = perf_counter()
+    for _ in range(messages):
+        user_id, guild_id = rng.randrange(USERS), rng.randrange(GUILDS)
+        stats: LevelingStats = await database.get_leveling_stats(user_id, guild_id)
+        stats.experience += rng.randint(15, 25)
+        await database.set_leveling_stats(stats)
+    await database.flush_leveling_stats()
+    return messages / (perf_counter() - start)
+
+
+async def main() -> None:
+    modes: dict[str, dict] = {
+        "Commit per message": {"flush_threshold": 1},
+        "Buffered, default settings": {}
+    }
+
+    print(f"Messages per second, {MESSAGES} messages from {USERS} users in {GUILDS} guilds")
+    for name, kwargs in modes.items():
+        with TemporaryDirectory() as directory:
+            database: Database = await open_database(Path(directory) / "database.sqlite", **kwargs)
+            try:
+                print(f"{name:<30} {await handle_messages(database):>10.0f}")
+            finally:
+                await database.close()
+
+
+if __name__ == "__main__":
+    run(main())
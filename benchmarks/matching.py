@@ -0,0 +1,110 @@
+"""
+Time spent ranking search results, the MatchScorer against the scorer it replaced.
+Run from the repository root: python -m benchmarks.matching
+"""
+
+from timeit import repeat
+from typing import Callable
+
+from numpy import array, ndarray, where
+
+from lib.music.matching import MatchScorer, tokenize
+from lib.utils import similarity
+
+BATCHES = (5, 50, 500)  # Results per search, 5 is what a search fetches
+ROUNDS = 200
+
+QUERY = ("Bohemian Rhapsody - Remastered 2011", "Queen", 354)
+
+
+def search_results(count: int) -> list[dict]:
+    """
+    :return: Search results resembling those of a music search, with a mix of titles, channels and durations.
+    """
+
+    variants = (
+        "Queen – Bohemian Rhapsody (Official Video Remastered)", "Bohemian Rhapsody (Live Aid 1985)",
+        "Bohemian Rhapsody 1 Hour Loop", "Queen - Bohemian Rhapsody (Piano Cover)", "Bohemian Rhapsody",
+        "Queen - Bohemian Rhapsody [Lyrics]", "Bohemian Rhapsody but it's sped up",
+        "Panic! At The Disco - Bohemian Rhapsody"
+    )
+    channels = ("Queen Official", "Queen - Topic", "Loop Station", "Piano Covers", "Lyrics Hub", "Panic! At The Disco")
+    return [
+        {
+            'title': f"{variants[i % len(variants)]} #{i}", 'channel': channels[i % len(channels)],
+            'duration': 354 + (i * 37) % 600 if i % 7 else None
+        }
+        for i in range(count)
+    ]
+
+
+def previous_best(results: list[dict], match: str) -> dict:
+    """The scorer before MatchScorer, the SequenceMatcher ratio of the titles only."""
+    return max(results, key=lambda x: similarity(x['title'], match))
+
+
+class ComprehensionScorer(MatchScorer):
+    """The first MatchScorer, which checked every result for every query token with nested comprehensions."""
+
+    def __init__(self, title: str, artist: str | None = None, duration: int | None = None) -> None:
+        super().__init__(title, artist, duration)
+        query_tokens: set[str] = set(self._title_tokens) | set(self._artist_tokens)
+        self._penalized = [token for token in self.PENALIZED_TOKENS if token not in query_tokens]
+
+    @staticmethod
+    def _contains_each(tokens: list[set[str]], vocabulary: list[str]) -> ndarray:
+        return array([[token in candidate for token in vocabulary] for candidate in tokens], dtype=bool).reshape(
+            len(tokens), len(vocabulary)
+        )
+
+    def score(self, results: list[dict]) -> ndarray:
+        titles: list[list[str]] = [tokenize(result.get('title')) for result in results]
+        title_sets: list[set[str]] = [set(title) for title in titles]
+        channel_sets: list[set[str]] = [
+            set(tokenize(result.get('channel') or result.get('uploader'))) | title for result, title
+            in zip(results, title_sets)
+        ]
+
+        weights: float = self.TITLE_WEIGHT
+        matched: ndarray = self._contains_each(title_sets, self._title_tokens).sum(axis=1)
+        recall: ndarray = matched / max(len(self._title_tokens), 1)
+        precision: ndarray = matched / array([max(len(title), 1) for title in titles])
+        total: ndarray = precision + recall
+        scores: ndarray = self.TITLE_WEIGHT * where(total > 0, 2 * precision * recall / where(total > 0, total, 1), 0.0)
+
+        if self._artist_tokens:
+            weights += self.ARTIST_WEIGHT
+            scores += self.ARTIST_WEIGHT * self._contains_each(channel_sets, self._artist_tokens).mean(axis=1)
+
+        if self._duration:
+            weights += self.DURATION_WEIGHT
+            scores += self.DURATION_WEIGHT * self._duration_score(results)
+
+        penalties: ndarray = self._contains_each(title_sets, self._penalized).sum(axis=1)
+        return scores / weights * self.PENALTY ** penalties
+
+
+SCORERS: dict[str, Callable[[list[dict]], dict]] = {
+    "SequenceMatcher (previous)": lambda results: previous_best(results, QUERY[0]),
+    "MatchScorer, comprehensions": lambda results: ComprehensionScorer(*QUERY).best(results),
+    "MatchScorer, vectorized": lambda results: MatchScorer(*QUERY).best(results)
+}
+
+
+def per_search(scorer: Callable[[list[dict]], dict], results: list[dict], rounds: int = ROUNDS) -> float:
+    """
+    :return: The best time in microseconds to rank one batch of results, query setup included.
+    """
+    return min(repeat(lambda: scorer(results), number=rounds, repeat=5)) / rounds * 1e6
+
+
+def main() -> None:
+    print("Microseconds per search, by results per search")
+    print(f"{'':<30}" + "".join(f"{count:>10}" for count in BATCHES))
+    batches: list[list[dict]] = [search_results(count) for count in BATCHES]
+    for name, scorer in SCORERS.items():
+        print(f"{name:<30}" + "".join(f"{per_search(scorer, results):>10.1f}" for results in batches))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Time of queue operations on a 10k song queue, the indexed SongQueue against the deque it replaced.
+Run from the repository root: python -m benchmarks.queue
+"""
+
+from asyncio import Queue
+from collections import deque
+from random import shuffle
+from timeit import repeat
+from typing import Callable
+
+from benchmarks.song_memory import REQUESTER, spotify_track
+from lib.music.queue import SongQueue
+from lib.music.song import Song
+from lib.spotify.track import Track
+
+SONGS = 10_000
+ROUNDS = 200
+
+
+class DequeQueue(Queue):
+    """The song queue before it was indexed, a deque that sums the durations when asked."""
+
+    _queue: deque
+
+    def __getitem__(self, item: int) -> Song:
+        return self._queue[item]
+
+    def __delitem__(self, key: int) -> None:
+        del self._queue[key]
+
+    def insert(self, index: int, item: Song) -> None:
+        self._queue.insert(index, item)
+
+    def shuffle(self) -> None:
+        shuffle(self._queue)
+
+    @property
+    def duration(self) -> int:
+        return sum(song.duration for song in self._queue)
+
+
+def filled(queue_type: type[Queue], songs: list[Song]) -> Queue:
+    queue: Queue = queue_type()
+    for song in songs:
+        queue.put_nowait(song)
+    return queue
+
+
+def operations(queue: Queue, song: Song) -> dict[str, Callable[[], object]]:
+    """
+    :return: The timed operations on a queue, insertion and removal are paired to keep its size.
+    """
+
+    middle: int = SONGS // 2
+
+    def insert_remove() -> None:
+        queue.insert(middle, song)
+        del queue[middle]
+
+    return {
+        "insert + remove, middle": insert_remove,
+        "index, middle": lambda: queue[middle],
+        "shuffle": queue.shuffle,
+        "duration": lambda: queue.duration
+    }
+
+
+def per_call(operation: Callable[[], object], rounds: int = ROUNDS) -> float:
+    """
+    :return: The best time in microseconds of one call.
+    """
+    return min(repeat(operation, number=rounds, repeat=5)) / rounds * 1e6
+
+
+def main() -> None:
+    songs: list[Song] = [Song(Track(spotify_track(i)), REQUESTER) for i in range(SONGS)]
+    extra: Song = Song(Track(spotify_track(SONGS)), REQUESTER)
+    timings: dict[str, dict[str, float]] = {
+        queue_type.__name__: {
+            name: per_call(operation, 10 if name == "shuffle" else ROUNDS)
+            for name, operation in operations(filled(queue_type, songs), extra).items()
+        }
+        for queue_type in (DequeQueue, SongQueue)
+    }
+
+    print(f"Microseconds per operation, {SONGS} queued songs")
+    print(f"{'':<26}" + "".join(f"{name:>14}" for name in timings))
+    for operation in timings["SongQueue"]:
+        print(f"{operation:<26}" + "".join(f"{timing[operation]:>14.2f}" for timing in timings.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Memory retained per queued song, for 10k queued songs of one guild.
+Run from the repository root: python -m benchmarks.song_memory
+"""
+
+from gc import collect
+from tracemalloc import start, stop, get_traced_memory
+from types import SimpleNamespace
+from typing import Any, Callable
+
+from lib.music.extraction import YTDLSource
+from lib.music.song import Song
+from lib.spotify.track import Track
+
+SONGS = 10_000
+
+REQUESTER = SimpleNamespace(id=1, mention="<@1>", guild=SimpleNamespace(id=1))  # Shared by all songs of a request
+
+
+def spotify_track(i: int) -> dict:
+    return {
+        "id": f"{i:022d}",
+        "name": f"Song Title Number {i}",
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{i:022d}"},
+        "duration_ms": 215_000,
+        "artists": [
+            {"id": artist, "name": name, "external_urls": {"spotify": f"https://open.spotify.com/artist/{artist}"}}
+            for artist, name in ((f"{i:021d}a", f"Artist {i}"), (f"{i:021d}b", f"Featured {i}"))
+        ]
+    }
+
+
+def info_dict(i: int) -> dict:
+    return {
+        "title": f"Artist {i} - Song Title Number {i} (Official Video)",
+        "uploader": f"Artist {i} - Topic",
+        "channel_url": f"https://www.youtube.com/channel/UC{i:022d}",
+        "webpage_url": f"https://www.youtube.com/watch?v={i:011d}",
+        "url": f"https://rr1---sn-{i:08d}.googlevideo.com/videoplayback?expire=4102444800&id={i:040d}&itag=251",
+        "view_count": 1_234_567 + i,
+        "like_count": 12_345 + i,
+        "duration": 215,
+        "upload_date": "20240101",
+        "thumbnail": f"https://i.ytimg.com/vi/{i:011d}/maxresdefault.jpg",
+        "acodec": "opus"
+    }
+
+
+class _FullEntry:
+    """A queue entry holding the full object, as queued songs did before they were compacted."""
+
+    def __init__(self, source: Any, requester: Any) -> None:
+        self._source = source
+        self._requester = requester
+
+
+def retained(make: Callable[[int], Any], count: int = SONGS) -> float:
+    """
+    :return: The bytes retained per object after creating count objects, temporary data excluded.
+    """
+
+    collect()
+    start()
+    objects: list[Any] = [make(i) for i in range(count)]
+    collect()
+    current, _ = get_traced_memory()
+    stop()
+    del objects
+    return current / count
+
+
+def released(i: int) -> Song:
+    song: Song = Song(YTDLSource(REQUESTER, data=info_dict(i)))
+    song.release()
+    return song
+
+
+CASES: dict[str, Callable[[int], Any]] = {
+    "Spotify track, full Track": lambda i: _FullEntry(Track(spotify_track(i)), REQUESTER),
+    "Spotify track, compact Song": lambda i: Song(Track(spotify_track(i)), REQUESTER),
+    "URL, full YTDLSource": lambda i: Song(YTDLSource(REQUESTER, data=info_dict(i))),
+    "URL, released Song": released
+}
+
+
+def main() -> None:
+    print(f"Bytes retained per queued song, {SONGS} songs")
+    for name, make in CASES.items():
+        print(f"{name:<30} {retained(make):>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Latency of Spotify requests against a local fake server, with the pooled session and with a session per request.
+Run from the repository root: python -m benchmarks.spotify
+"""
+
+from asyncio import run
+from statistics import median
+from time import perf_counter
+
+from lib.spotify.api import SpotifyAPI
+from tests.spotify_server import FakeSpotify
+
+REQUESTS = 200
+TOKEN_DELAY = 0.05  # Seconds the fake accounts service takes per token
+
+
+async def latencies(api: SpotifyAPI, new_session: bool) -> list[float]:
+    """
+    :param api: The client.
+    :param new_session: Whether each request opens a new session, as before the session was pooled.
+    :return: The latency of each request in milliseconds.
+    """
+
+    timings: list[float] = []
+    for i in range(REQUESTS):
+        start: float = perf_counter()
+        await api.get_track(str(i))
+        timings.append((perf_counter() - start) * 1000)
+        if new_session:
+            await api.session.close()
+    return timings
+
+
+async def main() -> None:
+    print(f"Milliseconds per uncached track request, {REQUESTS} requests on localhost")
+    print(f"{'':<22}{'first':>10}{'median':>10}{'max':>10}")
+    for name, new_session in (("Session per request", True), ("Pooled session", False)):
+        async with FakeSpotify(token_delay=TOKEN_DELAY) as server:
+            api: SpotifyAPI = server.client()
+            try:
+                timings: list[float] = await latencies(api, new_session)
+            finally:
+                await api.close()
+        print(f"{name:<22}{timings[0]:>10.2f}{median(timings[1:]):>10.2f}{max(timings[1:]):>10.2f}")
+    print(f"Token requests are {TOKEN_DELAY * 1000:.0f} ms, only the first request waits for one")
+
+
+if __name__ == "__main__":
+    run(main())
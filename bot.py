@@ -13,6 +13,7 @@ from lib.db.db_classes import Emoji
 from lib.emoji_loader import load_emojis
 from lib.logging import log, save_traceback
 from lib.spotify.api import SpotifyAPI
+from lib.spotify.cache import SpotifyCache
 from lib.utils import random_hex, shortened
 
 
@@ -22,8 +23,27 @@ class TornadoBot(Bot):
 
         self._uptime = None
         self._settings = SETTINGS
-        self._spotify = SpotifyAPI(environ["SPOTIFY_CLIENT_ID"], environ["SPOTIFY_CLIENT_SECRET"])
-        self._database = Database("./data/database.sqlite", self.loop)
+        self._database = Database(
+            SETTINGS['Database']['Path'],
+            self.loop,
+            readers=SETTINGS['Database']['Readers'],
+            synchronous=SETTINGS['Database']['Synchronous'],
+            cache_size=SETTINGS['Database']['CacheSize'],
+            mmap_size=SETTINGS['Database']['MmapSize'],
+            flush_interval=SETTINGS['Database']['FlushInterval'],
+            flush_threshold=SETTINGS['Database']['FlushThreshold'],
+            spotify_cache_ttl=SETTINGS['Spotify']['CacheTTL'],
+            resolution_ttl=SETTINGS['Music']['ResolutionTTL']
+        )
+        self._spotify = SpotifyAPI(
+            environ["SPOTIFY_CLIENT_ID"],
+            environ["SPOTIFY_CLIENT_SECRET"],
+            cache=SpotifyCache(
+                SETTINGS['Spotify']['CacheSize'],
+                SETTINGS['Spotify']['CacheTTL'],
+                database=self._database if SETTINGS['Spotify']['PersistCache'] else None
+            )
+        )
         self.presence_loop.start()
 
     @property
@@ -46,6 +66,15 @@ class TornadoBot(Bot):
         """Returns the database instance."""
         return self._database
 
+    async def start(self, *args, **kwargs) -> None:
+        await self.spotify.start()
+        await super().start(*args, **kwargs)
+
+    async def close(self) -> None:
+        await super().close()
+        await self.spotify.close()
+        await self.database.close()
+
     @loop(minutes=5)
     async def presence_loop(self) -> None:
         """Updates the bot presence every 5 minutes."""
@@ -11,6 +11,7 @@ from lib.leveling.calculation import xp_to_level
 from lib.leveling.leaderboard import gen_leaderboard
 from lib.leveling.level_up import generate_level_up_card
 from lib.leveling.rank_card import generate_rank_card
+from lib.leveling.views import LeaderboardPages
 
 
 class Leveling(Cog):
@@ -71,16 +72,54 @@ class Leveling(Cog):
         """Shows the leaderboard for the current guild."""
 
         await ctx.defer()
+        # Jumping to a page skips the rows before it with OFFSET, the next pages are seeked to with a cursor
         offset: int = (page - 1) * 19
-        _leaderboard: list[LevelingStats] = await self.bot.database.get_guild_leaderboard(
-            guild_id=ctx.guild.id,
-            limit=19,
-            offset=offset
-        )
-        if not _leaderboard:
-            emoji_cross: Emoji = await self.bot.database.get_emoji("cross")
-            await ctx.respond(f"{emoji_cross} **No leaderboard** found for this guild.")
-            return
+        cursor: str | None = None
+        while True:
+            # One more row than shown, to know whether there is a next page
+            _leaderboard: list[LevelingStats] = await self.bot.database.get_guild_leaderboard(
+                guild_id=ctx.guild.id,
+                limit=20,
+                offset=offset,
+                cursor=cursor
+            )
+            if not _leaderboard:
+                emoji_cross: Emoji = await self.bot.database.get_emoji("cross")
+                await ctx.respond(f"{emoji_cross} **No leaderboard** found for this guild.")
+                return
+
+            # Generate the leaderboard card and send it, with a button for the next page if there is one
+            view: LeaderboardPages | None = LeaderboardPages(ctx) if len(_leaderboard) > 19 else None
+            _leaderboard = _leaderboard[:19]
+            cards: list[File] = await self._leaderboard_cards(ctx, _leaderboard, page)
+            send = ctx.respond if cursor is None else ctx.send
+            for card in cards[:-1]:
+                await send(file=card)
+                send = ctx.send
+            if view is None:
+                await send(file=cards[-1])
+            else:
+                await send(file=cards[-1], view=view)
+
+            if view is None or await view.wait() or not view.value:
+                return
+            offset, cursor = 0, self.bot.database.leaderboard_cursor(_leaderboard[-1])
+            page += 1
+
+    async def _leaderboard_cards(
+            self,
+            ctx: CustomApplicationContext,
+            _leaderboard: list[LevelingStats],
+            page: int
+    ) -> list[File]:
+        """
+        Generates the cards of a leaderboard page. Stats of members who left the guild are removed.
+
+        :param ctx: The context of the command.
+        :param _leaderboard: The stats of the page.
+        :param page: The number of the page.
+        :return: The leaderboard cards.
+        """
 
         # Get the avatars of the users
         avatars: list[bytes] = []
@@ -104,10 +143,7 @@ class Leveling(Cog):
             user_names.append(user.name)
             leaderboard.append(stats)
 
-        # Generate the leaderboard card and send it
-        cards: list[File] = await gen_leaderboard(leaderboard, avatars, user_names, ctx.guild.name, page)
-        await ctx.respond(file=cards[0])
-        await ctx.send(file=cards[1]) if len(cards) > 1 else None
+        return await gen_leaderboard(leaderboard, avatars, user_names, ctx.guild.name, page)
 
     @slash_command()
     async def rank(
@@ -121,27 +157,13 @@ class Leveling(Cog):
         user = user or ctx.author
         stats: LevelingStats = await self.bot.database.get_leveling_stats(user.id, ctx.guild.id)
 
-        # Calculate the rank of the user in the guild.
-        # Get the leaderboard for the guild
-        leaderboard: list[LevelingStats] = await self.bot.database.get_guild_leaderboard(ctx.guild.id)
-
-        # Get the index of the user in the leaderboard
-        try:
-            rank: int = leaderboard.index(stats) + 1
-        except ValueError:
+        # Calculate the rank of the user in the guild and globally
+        rank: int | None = await self.bot.database.get_guild_rank(user.id, ctx.guild.id)
+        if rank is None:
             emoji_cross: Emoji = await self.bot.database.get_emoji("cross")
             await ctx.respond(f"{emoji_cross} **{user.name}** is **not ranked** in this guild.")
             return
-
-        # Calculate the rank of the user globally.
-        # Get the global leaderboard
-        leaderboard_global: list[LevelingStats] = await self.bot.database.get_global_leaderboard(-1)
-        for i, stats_global in enumerate(leaderboard_global):
-            if stats_global.user_id == user.id:
-                rank_global: int = i + 1
-                break
-        else:  # no break
-            rank_global: int = -1
+        rank_global: int = await self.bot.database.get_global_rank(user.id) or -1
 
         # Generate the rank card and send it
         card: File = await generate_rank_card(stats, user, rank, rank_global)
@@ -1,8 +1,9 @@
 from asyncio import QueueFull
+from contextlib import aclosing
 from math import ceil
-from random import shuffle
-from re import match
-from typing import Optional, Callable
+from random import shuffle, sample
+from re import match, findall
+from typing import Optional, Callable, AsyncGenerator
 from urllib.parse import urlparse, ParseResultBytes
 
 from discord import Member, VoiceState, VoiceClient, slash_command, Option, VoiceChannel, Embed, Color, \
@@ -11,19 +12,25 @@ from discord.ext.commands import Cog
 from yt_dlp import DownloadError
 
 from bot import TornadoBot
+from config.settings import SETTINGS
 from lib.contexts import CustomApplicationContext
 from lib.db.db_classes import Emoji
-from lib.exceptions import YouTubeNotEnabled, NotEnoughVotes
+from lib.exceptions import YouTubeNotEnabled, NotEnoughVotes, ExtractionQueueFull, ExtractionTimeout
 from lib.logging import save_traceback
 from lib.music.audio_player import AudioPlayer
 from lib.music.auto_complete import complete
 from lib.music.embeds import YOUTUBE_NOT_ENABLED
 from lib.music.extraction import YTDLSource
+from lib.music.scheduler import IdleScheduler
+from lib.music.search_query import SearchQuery
 from lib.music.song import Song
 from lib.music.views import QueueFill, LoopView
+from lib.spotify.album import Album
 from lib.spotify.artist import Artist
 from lib.spotify.data import SpotifyData
 from lib.spotify.exceptions import SpotifyNotFound, SpotifyRateLimit, SpotifyException
+from lib.spotify.track import Track
+from lib.spotify.track_collection import TrackCollection
 from lib.utils import format_time
 
 
@@ -33,14 +40,19 @@ class Music(Cog):
     def __init__(self, bot: TornadoBot) -> None:
         self.bot = bot
         self._audio_player = {}
+        self._idle_scheduler = IdleScheduler()  # Idle deadlines of all players
 
     def __getitem__(self, item: int) -> AudioPlayer:
         return self._audio_player[item]
 
+    def cog_unload(self) -> None:
+        YTDLSource.executor.shutdown()
+        self._idle_scheduler.close()
+
     async def _check_for_valid_player(self, ctx: CustomApplicationContext) -> bool:
         audio_player: AudioPlayer = self._audio_player.get(ctx.guild.id)
         if not audio_player:
-            audio_player = AudioPlayer(ctx)
+            audio_player = AudioPlayer(ctx, self._idle_scheduler)
             self._audio_player[ctx.guild.id] = audio_player
 
         emoji_cross: Emoji = await self.bot.database.get_emoji("cross")
@@ -66,17 +78,21 @@ class Music(Cog):
 
     @Cog.listener()
     async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState) -> None:
-        if member.id != self.bot.user.id:
-            return
         if before.channel == after.channel:
             return
 
         player: Optional[AudioPlayer] = self._audio_player.get(member.guild.id)
+        if member.id != self.bot.user.id:
+            if player:
+                player.update_listeners()  # Someone joined or left, possibly the channel of the player
+            return
+
         voice_client: VoiceClient = member.guild.voice_client  # type: ignore
 
         if not after.channel:
             if player:
                 player.voice = None
+                player.update_listeners()
             return
 
         if before.channel is None and after.channel is not None:
@@ -84,6 +100,7 @@ class Music(Cog):
 
         if player:
             player.voice = voice_client
+            player.update_listeners()
 
         if before.channel is not None and after.channel is not None:
             voice_client.pause()
@@ -107,7 +124,7 @@ class Music(Cog):
             pass
 
         if not self._audio_player.get(ctx.guild.id):
-            self._audio_player[ctx.guild.id] = AudioPlayer(ctx)
+            self._audio_player[ctx.guild.id] = AudioPlayer(ctx, self._idle_scheduler)
         emoji_cross: Emoji = await self.bot.database.get_emoji("cross")  # Get the cross-emoji
 
         if destination := destination or ctx.author.voice.channel:
@@ -164,9 +181,8 @@ class Music(Cog):
             return
 
         if audio_player.current:
-            author_has_all_entries: bool = all(
-                [entry.requester.id == ctx.author.id for entry in audio_player]
-            ) and audio_player.current.requester.id == ctx.author.id
+            author_has_all_entries: bool = audio_player.requests_of(ctx.author.id) == len(audio_player) \
+                and audio_player.current.requester.id == ctx.author.id
             if author_has_all_entries:
                 audio_player.leave()
                 del self._audio_player[ctx.guild.id]
@@ -201,7 +217,18 @@ class Music(Cog):
 
         #  Analyze the search query
         parse_result: ParseResultBytes = urlparse(search)
-        if parse_result.netloc == "open.spotify.com":  # If the search query is not a Spotify URL
+        links: list[tuple[str, str]] = findall(
+            r"(?:https://)?open\.spotify\.com/(?:intl-\w+/)?(track|album)/(\w+)", search
+        )
+        if len(links) > 1:  # If the search query is a list of Spotify track and album URLs
+            try:
+                result = await self._get_spotify_links(links)
+            except SpotifyException as e:
+                await ctx.respond(f"{emoji_cross} **Spotify** API **error**.")
+                if isinstance(e, SpotifyRateLimit):
+                    return
+                return await save_traceback(e)
+        elif parse_result.netloc == "open.spotify.com":  # If the search query is not a Spotify URL
             functions: dict[str, Callable] = {
                 "track": ctx.bot.spotify.get_track,
                 "album": ctx.bot.spotify.get_album,
@@ -230,6 +257,9 @@ class Music(Cog):
             except DownloadError:
                 await ctx.respond(f"{emoji_cross} **Download error**. Try a different source.")
                 return
+            except (ExtractionQueueFull, ExtractionTimeout):
+                await ctx.respond(f"{emoji_cross} **Too many requests** right now. Try again **later**.")
+                return
         else:  # If the search query is a search query
             if match(r"Playlist: .+", search):
                 playlist_suggestions: list[SpotifyData] = await ctx.bot.spotify.get_trending_playlists()
@@ -237,15 +267,7 @@ class Music(Cog):
                 for playlist in playlist_suggestions:
                     if search[10:] == playlist.name:
                         return await self.play(ctx, playlist.url)
-            try:
-                result = await YTDLSource.from_search(
-                    ctx.author,
-                    search,
-                    loop=self.bot.loop
-                )
-            except ValueError:
-                await ctx.respond(f"{emoji_cross} **No results**.", ephemeral=True)
-                return
+            result = SearchQuery(search)  # Searched by the player in the background, failures are reported there
 
         # Check for valid existing player
         if not await self._check_for_valid_player(ctx):
@@ -311,27 +333,114 @@ class Music(Cog):
             await ctx.respond(f"{emoji_playlist} **Added** `{len(result)}` **tracks to the queue**.")
             return
 
+        # Tracks are queued as soon as they are loaded, so playback starts before all pages arrived
+        added: list[Track] = []
+
+        def enqueue(tracks: list[Track]) -> bool:
+            fitting: list[Track] = tracks[:audio_player.free]
+            audio_player.extend([Song(track, ctx.author) for track in fitting])
+            added.extend(fitting)
+            return len(fitting) == len(tracks)
+
         try:
             start, stop = view.value.split(" - ")
         except ValueError:
-            tracks = await ctx.bot.spotify.get_playlist_tracks(result.id, len(result), result.total)
-            result.tracks.extend(tracks)
-            shuffle(result.tracks)
-            result.tracks = result.tracks[:200 - len(audio_player)]
+            # Select random tracks of the whole collection, loaded tracks are queued first
+            selection: set[int] = set(sample(range(result.total), min(result.total, audio_player.free)))
+            loaded: list[Track] = [track for i, track in enumerate(result) if i in selection]
+            shuffle(loaded)
+
+            offset: int = len(result)
+            if enqueue(loaded) and result.total > len(result):
+                try:
+                    # Unavailable tracks are kept as None, so page positions stay playlist indices
+                    async with aclosing(self._iter_tracks(result, len(result), result.total, True)) as pages:
+                        async for page in pages:
+                            chosen: list[Track] = [
+                                track for i, track in enumerate(page, offset) if i in selection and track
+                            ]
+                            offset += len(page)
+                            shuffle(chosen)
+                            if not enqueue(chosen):
+                                break
+                except SpotifyException as e:
+                    await self._report_spotify_error(ctx, e)
         else:
             start, stop = int(start) - 1, int(stop)
 
-            result.tracks = result[start:stop]
-            tracks = await ctx.bot.spotify.get_playlist_tracks(result.id, start + len(result), stop)
-            result.tracks.extend(tracks)
+            if enqueue(result[start:stop]) and stop > len(result):
+                try:
+                    async with aclosing(self._iter_tracks(result, max(start, len(result)), stop)) as pages:
+                        async for page in pages:
+                            if not enqueue(page):
+                                break
+                except SpotifyException as e:
+                    await self._report_spotify_error(ctx, e)
 
-        for track in result:
-            audio_player.put(Song(track, ctx.author))
-
-        if len(result) > 1:
-            await ctx.respond(f"{emoji_playlist} **Added** `{len(result)}` **tracks to the queue**.")
+        if len(added) > 1:
+            await ctx.respond(f"{emoji_playlist} **Added** `{len(added)}` **tracks to the queue**.")
+            return
+        if not added:
+            await ctx.respond(f"{emoji_cross} **No tracks** were **added to the queue**.")
             return
-        await ctx.respond(f"{emoji_checkmark} **Added** `{result[0].name}` **to the queue**.")
+        await ctx.respond(f"{emoji_checkmark} **Added** `{added[0].name}` **to the queue**.")
+
+    async def _get_spotify_links(self, links: list[tuple[str, str]]) -> TrackCollection:
+        """
+        Loads pasted Spotify track and album links with one request per chunk of tracks and albums.
+
+        :param links: The kind and Spotify ID of each link.
+        :return: The tracks of all links, in the order they were pasted.
+        """
+
+        tracks: dict[str, Track] = {
+            track.id: track for track in await self.bot.spotify.get_tracks([i for kind, i in links if kind == "track"])
+        }
+        albums: dict[str, Album] = {
+            album.id: album for album in await self.bot.spotify.get_albums([i for kind, i in links if kind == "album"])
+        }
+
+        # Every call builds new album objects, so their tracks can be extended safely
+        for album in albums.values():
+            if album.total > len(album):
+                async for page in self.bot.spotify.iter_album_tracks(album.id, len(album), album.total):
+                    album.tracks.extend(page)
+
+        collection: list[Track] = []
+        for kind, spotify_id in links:
+            if kind == "track" and spotify_id in tracks:
+                collection.append(tracks[spotify_id])
+            elif kind == "album" and spotify_id in albums:
+                collection.extend(albums[spotify_id])
+        return TrackCollection.from_tracks(collection)
+
+    def _iter_tracks(
+            self,
+            collection: TrackCollection,
+            start: int,
+            end: int,
+            keep_missing: bool = False
+    ) -> AsyncGenerator[list[Track | None], None]:
+        """
+        Streams the not yet loaded tracks of an album or playlist page by page.
+
+        :param collection: The album or playlist.
+        :param start: The start index of the tracks to retrieve.
+        :param end: The end index of the tracks to retrieve.
+        :param keep_missing: Whether unavailable playlist tracks are yielded as None instead of being left out.
+        :return: The tracks of each page.
+        """
+
+        if isinstance(collection, Album):
+            return self.bot.spotify.iter_album_tracks(collection.id, start, end)
+        return self.bot.spotify.iter_playlist_tracks(collection.id, start, end, keep_missing)
+
+    @staticmethod
+    async def _report_spotify_error(ctx: CustomApplicationContext, exception: SpotifyException) -> None:
+        emoji_cross: Emoji = await ctx.bot.database.get_emoji("cross")
+        await ctx.respond(f"{emoji_cross} **Spotify** API **error**, not all tracks could be loaded.")
+        if not isinstance(exception, SpotifyRateLimit):
+            await save_traceback(exception)
 
     @slash_command()
     async def playnext(
@@ -380,16 +489,11 @@ class Music(Cog):
             except DownloadError:
                 await ctx.respond(f"{emoji_cross} **Download error**. Try a different source.")
                 return
-        else:  # If the search query is a search query
-            try:
-                result = await YTDLSource.from_search(
-                    ctx.author,
-                    search,
-                    loop=self.bot.loop
-                )
-            except ValueError:
-                await ctx.respond(f"{emoji_cross} **No results**.")
+            except (ExtractionQueueFull, ExtractionTimeout):
+                await ctx.respond(f"{emoji_cross} **Too many requests** right now. Try again **later**.")
                 return
+        else:  # If the search query is a search query
+            result = SearchQuery(search)  # Searched by the player in the background, failures are reported there
 
         # Check for valid existing player
         if not await self._check_for_valid_player(ctx):
@@ -572,26 +676,10 @@ class Music(Cog):
             "**Requesters:**\n"
         )
 
-        emojis: list[Emoji] = [
-            await ctx.bot.database.get_emoji("aubanana"),
-            await ctx.bot.database.get_emoji("aublack"),
-            await ctx.bot.database.get_emoji("aublue"),
-            await ctx.bot.database.get_emoji("aubrown"),
-            await ctx.bot.database.get_emoji("augreen"),
-            await ctx.bot.database.get_emoji("augrey"),
-            await ctx.bot.database.get_emoji("auorange"),
-            await ctx.bot.database.get_emoji("aupink"),
-            await ctx.bot.database.get_emoji("aupurple"),
-            await ctx.bot.database.get_emoji("auyellow"),
-            await ctx.bot.database.get_emoji("auwhite"),
-            await ctx.bot.database.get_emoji("aucyan"),
-            await ctx.bot.database.get_emoji("aumaroon"),
-            await ctx.bot.database.get_emoji("aucoral"),
-            await ctx.bot.database.get_emoji("aurose"),
-            await ctx.bot.database.get_emoji("autan"),
-            await ctx.bot.database.get_emoji("aulime"),
-            await ctx.bot.database.get_emoji("aured")
-        ]
+        emojis: list[Emoji] = await ctx.bot.database.get_emojis([
+            "aubanana", "aublack", "aublue", "aubrown", "augreen", "augray", "auorange", "aupink", "aupurple",
+            "auyellow", "auwhite", "aucyan", "aumaroon", "aucoral", "aurose", "autan", "aulime", "aured"
+        ])
         shuffle(emojis)
 
         #  requester.mention: emoji
@@ -705,7 +793,7 @@ class Music(Cog):
         )
         for i, song in enumerate(audio_player.history, start=1):
             embed.add_field(
-                name=f"{i}. {song.source.name}",
+                name=f"{i}. {song.title}",
                 value=f"**Duration:** `{format_time(song.duration)}`\n"
                       f"**Requester:** {song.requester.mention}",
                 inline=False
@@ -766,7 +854,9 @@ class Music(Cog):
     async def remove(
             self,
             ctx: CustomApplicationContext,
-            index: Option(int, "The index of the song to remove.", min_value=1, max_value=200)
+            index: Option(
+                int, "The index of the song to remove.", min_value=1, max_value=SETTINGS['Music']['QueueSize']
+            )
     ) -> None:
         """Removes a song from the queue."""
         audio_player: AudioPlayer = self._audio_player.get(ctx.guild.id)
@@ -783,7 +873,7 @@ class Music(Cog):
             return
 
         emoji_checkmark2: Emoji = await self.bot.database.get_emoji("checkmark2")
-        await ctx.respond(f"{emoji_checkmark2} **Removed** `{song.source.name}` from the queue.")
+        await ctx.respond(f"{emoji_checkmark2} **Removed** `{song.title}` from the queue.")
 
 
 def setup(bot: TornadoBot) -> None:
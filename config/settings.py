@@ -8,8 +8,38 @@ intents.__setattr__("messages", True)
 
 
 SETTINGS: dict[str, Any] = {
+    'Database': {
+        'Path': './data/database.sqlite',
+        'Readers': 4,  # Read-only connections used for SELECTs
+        'Synchronous': 'NORMAL',  # Safe in WAL mode, only the last transactions may be lost on power loss
+        'CacheSize': -16000,  # Negative values are KiB, positive values pages
+        'MmapSize': 268435456,
+        'FlushInterval': 10,  # Seconds between writes of buffered leveling stats
+        'FlushThreshold': 500  # Buffered leveling stats that trigger a write before the interval passed
+    },
     'Music': {
-        'YouTubeEnabled': True
+        'YouTubeEnabled': True,
+        'QueueSize': 200,  # Maximum number of queued songs per guild
+        'PrefetchWindow': 3,  # Number of upcoming songs resolved in the background
+        'PrefetchRefreshMargin': 600,  # Upcoming stream URLs expiring within this many seconds are re-resolved
+        'ExtractionWorkers': 4,  # Concurrent yt-dlp extractions
+        'ExtractionQueueSize': 64,  # Extractions waiting for a worker before new ones are rejected
+        'ExtractionTimeout': 30,  # Seconds an extraction may wait and run
+        'ExtractionProcesses': False,  # Whether extractions run in worker processes instead of threads
+        'SinglePassSearch': True,
+        'ResolutionTTL': 604800,  # Seconds a Spotify track stays mapped to the page found for it  # Whether a search and the extraction of its best match run as one job
+        'Volume': 0.5,
+        'OpusPassthrough': False  # Whether ffmpeg outputs Opus for Opus streams, copied at a volume of 1.0
+    },
+    'Spotify': {
+        'CacheSize': 1024,  # Number of cached tracks, albums, artists and playlists
+        'CacheTTL': {  # Seconds a cached response is used without asking Spotify again
+            'track': 86400,
+            'album': 86400,
+            'artist': 3600,
+            'playlist': 600
+        },
+        'PersistCache': True  # Whether cached responses are stored in the database
     },
     'OwnerIDs': [
         272446903940153345
@@ -19,6 +19,10 @@ CREATE TABLE IF NOT EXISTS Leveling (
     PRIMARY KEY (guildId, userId)
 );
 
+CREATE INDEX IF NOT EXISTS LevelingGuildXp ON Leveling (guildId, xp DESC, userId);
+CREATE INDEX IF NOT EXISTS LevelingXp ON Leveling (xp DESC, guildId, userId);
+CREATE INDEX IF NOT EXISTS LevelingUserXp ON Leveling (userId, xp);
+
 
 CREATE TABLE IF NOT EXISTS GuildSettings (
     guildId INTEGER NOT NULL,
@@ -43,4 +47,29 @@ CREATE TABLE IF NOT EXISTS UserStats (
     musicPlayed INTEGER NOT NULL DEFAULT 0,
     songsPlayed INTEGER NOT NULL DEFAULT 0,
     PRIMARY KEY (userId)
-);
\ No newline at end of file
+);
+
+
+CREATE TABLE IF NOT EXISTS TrackResolutions (
+    spotifyId TEXT NOT NULL,
+    url TEXT NOT NULL,
+    data TEXT NOT NULL,
+    resolvedAt INTEGER NOT NULL,
+    PRIMARY KEY (spotifyId)
+);
+
+
+CREATE TABLE IF NOT EXISTS StreamUrls (
+    url TEXT NOT NULL,
+    streamUrl TEXT NOT NULL,
+    expiresAt INTEGER NOT NULL,
+    PRIMARY KEY (url)
+);
+
+CREATE TABLE IF NOT EXISTS SpotifyCache (
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    etag TEXT,
+    cachedAt INTEGER NOT NULL,
+    PRIMARY KEY (key)
+);
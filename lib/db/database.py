@@ -1,10 +1,16 @@
-from asyncio import AbstractEventLoop
+from asyncio import AbstractEventLoop, Lock, Queue, sleep
+from contextlib import asynccontextmanager
+from json import dumps, loads
 from pathlib import Path
+from time import time
+from typing import AsyncIterator
 
-from aiosqlite import connect
+from aiosqlite import connect, Connection, Error
 
-from lib.db.db_classes import Emoji, LevelingStats, GuildSettings, UserStats
+from lib.db.db_classes import Emoji, LevelingStats, GuildSettings, UserStats, TrackResolution, StreamUrl, \
+    SpotifyCacheEntry
 from lib.enums import SongEmbedSize
+from lib.logging import log
 
 
 def _open_file() -> bytes:
@@ -13,10 +19,62 @@ def _open_file() -> bytes:
 
 
 class Database:  # aiosqlite3
-    def __init__(self, path: Path | str, loop: AbstractEventLoop) -> None:
-        self._db = None
+    """
+    Pooled SQLite database in WAL mode.
+    All writes go through a single writer connection, reads are spread across several read-only connections.
+    """
+
+    _readers: Queue[Connection]
+
+    MAX_PARAMETERS = 500  # Per query, below the host parameter limit of older SQLite versions
+
+    def __init__(
+            self,
+            path: Path | str,
+            loop: AbstractEventLoop,
+            *,
+            readers: int = 4,
+            synchronous: str = "NORMAL",
+            cache_size: int = -16000,
+            mmap_size: int = 268435456,
+            flush_interval: float = 10,
+            flush_threshold: int = 500,
+            spotify_cache_ttl: dict[str, int] | None = None,
+            resolution_ttl: int | None = None
+    ) -> None:
+        self._db = None  # Writer connection
+        self._readers = Queue()
+        self._write_lock = Lock()
         self._loop = loop
+        self._emojis: dict[str, Emoji] = {}
+
+        self._reader_count = readers
+        self._pragmas = {
+            "synchronous": synchronous,
+            "cache_size": cache_size,
+            "mmap_size": mmap_size
+        }
+
+        # Write-behind buffer for leveling stats, keyed by (guild_id, user_id)
+        self._leveling_buffer: dict[tuple[int, int], LevelingStats] = {}
+        self._leveling_flushing: dict[tuple[int, int], LevelingStats] = {}
+        self._flush_lock = Lock()
+        self._flush_interval = flush_interval
+        self._flush_threshold = flush_threshold
+
+        # Seconds per kind after which persisted Spotify responses are purged on startup
+        self._spotify_cache_ttl = spotify_cache_ttl or {}
+        # Seconds after which track resolutions are purged on startup, they are never purged if None
+        self._resolution_ttl = resolution_ttl
+
         loop.create_task(self._connect(path))
+        self._flush_task = loop.create_task(self._flush_loop())
+
+    async def _open(self, database: str, **kwargs) -> Connection:
+        db: Connection = await connect(database, **kwargs)
+        for pragma, value in self._pragmas.items():
+            await db.execute(f"PRAGMA {pragma} = {value};")
+        return db
 
     async def _connect(self, path: Path | str) -> None:
         # Check if database exists
@@ -25,24 +83,96 @@ class Database:  # aiosqlite3
 
         if not path.exists():
             path.touch()
-        self._db = await connect(path)
+        db: Connection = await self._open(str(path))
+        await db.execute("PRAGMA journal_mode = WAL;")
 
         #  Execute build.sql to create tables
         _bytes = await self._loop.run_in_executor(None, _open_file)
-        await self._db.executescript(_bytes.decode("utf-8"))
-        await self._db.commit()
+        await db.executescript(_bytes.decode("utf-8"))
+        await db.execute("DELETE FROM StreamUrls WHERE expiresAt <= ?;", (int(time()),))
+        if self._resolution_ttl is not None:
+            await db.execute(
+                "DELETE FROM TrackResolutions WHERE resolvedAt <= ?;", (int(time()) - self._resolution_ttl,)
+            )
+        await db.executemany(
+            "DELETE FROM SpotifyCache WHERE key LIKE ? AND cachedAt <= ?;",
+            [(f"{kind}:%", int(time()) - ttl) for kind, ttl in self._spotify_cache_ttl.items()]
+        )
+        await db.commit()
+
+        # Readers are opened after the schema exists, they cannot create it
+        for _ in range(self._reader_count):
+            self._readers.put_nowait(await self._open(f"{path.resolve().as_uri()}?mode=ro", uri=True))
+
+        # Preload all emojis, they are requested by nearly every command
+        async with db.execute("SELECT emoji, name, isAnimated, guildId FROM Emojis;") as cursor:
+            self._emojis = {data[1]: Emoji(*data) for data in await cursor.fetchall()}
+        self._db = db
+
+    @asynccontextmanager
+    async def _read(self) -> AsyncIterator[Connection]:
+        """Checks out a read-only connection. Falls back to the writer if no readers are configured."""
+        if not self._reader_count:
+            yield self._db
+            return
+
+        db: Connection = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def _write(self) -> AsyncIterator[Connection]:
+        """Acquires the writer connection. Writes are serialized."""
+        async with self._write_lock:
+            yield self._db
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await sleep(self._flush_interval)
+            if self._db is None:
+                continue
+
+            try:
+                await self.flush_leveling_stats()
+            except Error as e:
+                log(f"Failed to flush leveling stats: {e}", error=True)
+
+    async def close(self) -> None:
+        """
+        Flushes all buffered writes and closes the connection.
+        :return: None
+        """
+
+        self._flush_task.cancel()
+        if self._db is None:
+            return
+
+        await self.flush_leveling_stats()
+        while not self._readers.empty():
+            await self._readers.get_nowait().close()
+        async with self._write() as db:
+            await db.close()
+        self._db = None
 
     async def get_emoji(self, name: str) -> Emoji | None:
         """
-        Gets an emoji from the database.
+        Gets an emoji from the in-memory emoji cache.
         :param name: The name of the emoji to get.
         :return: Emoji or None if not found.
         """
 
-        async with self._db.execute(
-                "SELECT emoji, name, isAnimated, guildId FROM Emojis WHERE name = ?", (name,)) as cursor:
-            if data := await cursor.fetchone():
-                return Emoji(*data)
+        return self._emojis.get(name)
+
+    async def get_emojis(self, names: list[str]) -> list[Emoji | None]:
+        """
+        Gets multiple emojis from the in-memory emoji cache.
+        :param names: The names of the emojis to get.
+        :return: List of Emoji or None if not found, in the same order as names.
+        """
+
+        return [self._emojis.get(name) for name in names]
 
     async def set_emoji(self, emoji: Emoji) -> None:
         """
@@ -53,17 +183,18 @@ class Database:  # aiosqlite3
         :raises ValueError: If the guild is not an emoji guild.
         """
 
-        async with self._db.execute(
+        async with self._read() as db, db.execute(
             "SELECT guildId FROM EmojiGuilds WHERE guildId = ?;", (emoji.guild_id,)
         ) as cursor:
             if not await cursor.fetchone():
                 raise ValueError(f"Guild {emoji.guild_id} is not in the system database.")
 
-        async with self._db.execute(
+        async with self._write() as db, db.execute(
                 "REPLACE INTO Emojis (emoji, name, isAnimated, guildId) VALUES (?, ?, ?, ?);",
                 (emoji.emoji_id, emoji.name, emoji.is_animated, emoji.guild_id)
         ):
-            await self._db.commit()
+            await db.commit()
+        self._emojis[emoji.name] = emoji
 
     async def get_emoji_guilds(self) -> list[int]:
         """
@@ -71,7 +202,7 @@ class Database:  # aiosqlite3
         :return: List of guild IDs.
         """
 
-        async with self._db.execute("SELECT guildId FROM EmojiGuilds;") as cursor:
+        async with self._read() as db, db.execute("SELECT guildId FROM EmojiGuilds;") as cursor:
             return [guild[0] for guild in await cursor.fetchall()]
 
     async def add_emoji_guild(self, guild_id: int) -> None:
@@ -81,36 +212,129 @@ class Database:  # aiosqlite3
         :return: None
         """
 
-        async with self._db.execute("INSERT INTO EmojiGuilds (guildId) VALUES (?);", (guild_id,)):
-            await self._db.commit()
+        async with self._write() as db, db.execute("INSERT INTO EmojiGuilds (guildId) VALUES (?);", (guild_id,)):
+            await db.commit()
 
-    async def get_guild_leaderboard(self, guild_id: int, limit: int = 19, offset: int = 0) -> list[LevelingStats]:
+    @staticmethod
+    def leaderboard_cursor(stats: LevelingStats) -> str:
+        """
+        Creates a cursor token pointing after the given stats, used to fetch the next leaderboard page.
+        :param stats: The last stats of the current page.
+        :return: The cursor token.
         """
-        Gets the leaderboard for a guild.
+        return f"{stats.experience}:{stats.guild_id}:{stats.user_id}"
+
+    @staticmethod
+    def _parse_cursor(cursor: str) -> tuple[int, int, int]:
+        try:
+            xp, guild_id, user_id = (int(part) for part in cursor.split(":"))
+        except ValueError:
+            raise ValueError(f"Invalid leaderboard cursor: {cursor}")
+        return xp, guild_id, user_id
+
+    async def get_guild_leaderboard(
+            self,
+            guild_id: int,
+            limit: int = 19,
+            offset: int = 0,
+            cursor: str | None = None
+    ) -> list[LevelingStats]:
+        """
+        Gets the leaderboard for a guild, ordered by XP and user ID.
+        Pass a cursor from :meth:`leaderboard_cursor` to seek to the next page instead of skipping rows.
         :param guild_id: The guild ID to get the leaderboard for.
         :param limit: The limit of users to get.
-        :param offset: The offset to start from.
+        :param offset: The offset to start from, relative to the cursor if given.
+        :param cursor: The cursor token of the last row of the previous page.
         :return: List of LevelingStats.
+
+        :raises ValueError: If the cursor is invalid.
         """
 
-        async with self._db.execute(
-                "SELECT * FROM Leveling WHERE guildId = ? ORDER BY xp DESC LIMIT ?;",
-                (guild_id, limit + offset)) as cursor:
-            return [LevelingStats(*data) for data in await cursor.fetchall()][offset:]
+        await self.flush_leveling_stats()
+        if cursor is None:
+            query: str = "SELECT * FROM Leveling WHERE guildId = ? ORDER BY xp DESC, userId LIMIT ? OFFSET ?;"
+            params: tuple = (guild_id, limit, offset)
+        else:
+            xp, _, user_id = self._parse_cursor(cursor)
+            query: str = (
+                "SELECT * FROM Leveling WHERE guildId = ?1 AND (xp < ?2 OR (xp = ?2 AND userId > ?3)) "
+                "ORDER BY xp DESC, userId LIMIT ?4 OFFSET ?5;"
+            )
+            params: tuple = (guild_id, xp, user_id, limit, offset)
+
+        async with self._read() as db, db.execute(query, params) as cursor:
+            return [LevelingStats(*data) for data in await cursor.fetchall()]
 
-    async def get_global_leaderboard(self, limit: int = 19, offset: int = 0) -> list[LevelingStats]:
+    async def get_global_leaderboard(
+            self,
+            limit: int = 19,
+            offset: int = 0,
+            cursor: str | None = None
+    ) -> list[LevelingStats]:
         """
-        Gets the global leaderboard.
+        Gets the global leaderboard, ordered by XP, guild ID and user ID.
+        Pass a cursor from :meth:`leaderboard_cursor` to seek to the next page instead of skipping rows.
         :param limit: The limit of users to get.
-        :param offset: The offset to start from.
+        :param offset: The offset to start from, relative to the cursor if given.
+        :param cursor: The cursor token of the last row of the previous page.
         :return: List of LevelingStats.
+
+        :raises ValueError: If the cursor is invalid.
         """
 
-        async with self._db.execute(
-                "SELECT * FROM Leveling ORDER BY xp DESC LIMIT ?;",
-                (limit + offset,)) as cursor:
+        await self.flush_leveling_stats()
+        if cursor is None:
+            query: str = "SELECT * FROM Leveling ORDER BY xp DESC, guildId, userId LIMIT ? OFFSET ?;"
+            params: tuple = (limit, offset)
+        else:
+            query: str = (
+                "SELECT * FROM Leveling "
+                "WHERE xp < ?1 OR (xp = ?1 AND (guildId > ?2 OR (guildId = ?2 AND userId > ?3))) "
+                "ORDER BY xp DESC, guildId, userId LIMIT ?4 OFFSET ?5;"
+            )
+            params: tuple = (*self._parse_cursor(cursor), limit, offset)
+
+        async with self._read() as db, db.execute(query, params) as cursor:
             return [LevelingStats(*data) for data in await cursor.fetchall()]
 
+    async def get_guild_rank(self, user_id: int, guild_id: int) -> int | None:
+        """
+        Gets the rank of a user in a guild. Users with the same XP are ordered by their ID.
+        :param user_id: The user ID to get the rank for.
+        :param guild_id: The guild ID to get the rank in.
+        :return: The rank, starting at 1, or None if the user is not ranked.
+        """
+
+        await self.flush_leveling_stats()
+        async with self._read() as db:
+            async with db.execute(
+                    "SELECT xp FROM Leveling WHERE guildId = ? AND userId = ?;", (guild_id, user_id)) as cursor:
+                if not (data := await cursor.fetchone()):
+                    return None
+
+            async with db.execute(
+                    "SELECT (SELECT COUNT(*) FROM Leveling WHERE guildId = ?1 AND xp > ?2) + "
+                    "(SELECT COUNT(*) FROM Leveling WHERE guildId = ?1 AND xp = ?2 AND userId < ?3) + 1;",
+                    (guild_id, data[0], user_id)) as cursor:
+                return (await cursor.fetchone())[0]
+
+    async def get_global_rank(self, user_id: int) -> int | None:
+        """
+        Gets the global rank of a user, based on the user's best guild.
+        :param user_id: The user ID to get the rank for.
+        :return: The rank, starting at 1, or None if the user is not ranked.
+        """
+
+        await self.flush_leveling_stats()
+        async with self._read() as db:
+            async with db.execute("SELECT MAX(xp) FROM Leveling WHERE userId = ?;", (user_id,)) as cursor:
+                if (xp := (await cursor.fetchone())[0]) is None:
+                    return None
+
+            async with db.execute("SELECT COUNT(*) + 1 FROM Leveling WHERE xp > ?;", (xp,)) as cursor:
+                return (await cursor.fetchone())[0]
+
     async def get_leveling_stats(self, user_id: int, guild_id: int) -> LevelingStats:
         """
         Gets a user's leveling stats.
@@ -119,7 +343,11 @@ class Database:  # aiosqlite3
         :return: LevelingStats
         """
 
-        async with self._db.execute(
+        key: tuple[int, int] = (guild_id, user_id)
+        if stats := self._leveling_buffer.get(key) or self._leveling_flushing.get(key):
+            return stats
+
+        async with self._read() as db, db.execute(
                 "SELECT * FROM Leveling WHERE userId = ? AND guildId = ?;",
                 (user_id, guild_id)) as cursor:
             if data := await cursor.fetchone():
@@ -129,12 +357,40 @@ class Database:  # aiosqlite3
     async def set_leveling_stats(self, stats: LevelingStats) -> None:
         """
         Sets a user's LevelingStats stats.
+        The stats are buffered and written in batches, see :meth:`flush_leveling_stats`.
         :param stats: The stats to set.
         :return: None
         """
 
-        async with self._db.execute("REPLACE INTO Leveling VALUES (?, ?, ?, ?);", (*stats,)):
-            await self._db.commit()
+        self._leveling_buffer[(stats.guild_id, stats.user_id)] = stats
+        if len(self._leveling_buffer) >= self._flush_threshold:
+            await self.flush_leveling_stats()
+
+    async def flush_leveling_stats(self) -> None:
+        """
+        Writes all buffered LevelingStats to the database in a single transaction.
+        :return: None
+        """
+
+        async with self._flush_lock:
+            if not self._leveling_buffer:
+                return
+
+            # Keep serving the swapped out stats until they are committed
+            self._leveling_flushing, self._leveling_buffer = self._leveling_buffer, {}
+            try:
+                async with self._write() as db:
+                    await db.executemany(
+                        "REPLACE INTO Leveling VALUES (?, ?, ?, ?);",
+                        [(*stats,) for stats in self._leveling_flushing.values()]
+                    )
+                    await db.commit()
+            except Exception:
+                # Put the stats back, newer writes take precedence
+                self._leveling_buffer = self._leveling_flushing | self._leveling_buffer
+                raise
+            finally:
+                self._leveling_flushing = {}
 
     async def remove_leveling_stats(self, user_id: int | None, guild_id: int) -> None:
         """
@@ -144,13 +400,15 @@ class Database:  # aiosqlite3
         :return: None
         """
 
+        await self.flush_leveling_stats()
         if not user_id:
-            async with self._db.execute("DELETE FROM Leveling WHERE guildId = ?;", (guild_id,)):
-                await self._db.commit()
+            async with self._write() as db, db.execute("DELETE FROM Leveling WHERE guildId = ?;", (guild_id,)):
+                await db.commit()
             return
 
-        async with self._db.execute("DELETE FROM Leveling WHERE userId = ? AND guildId = ?;", (user_id, guild_id)):
-            await self._db.commit()
+        async with self._write() as db, db.execute(
+                "DELETE FROM Leveling WHERE userId = ? AND guildId = ?;", (user_id, guild_id)):
+            await db.commit()
 
     async def get_guild_settings(self, guild_id: int) -> GuildSettings:
         """
@@ -159,7 +417,8 @@ class Database:  # aiosqlite3
         :return: GuildSettings.
         """
 
-        async with self._db.execute("SELECT * FROM GuildSettings WHERE guildId = ?;", (guild_id,)) as cursor:
+        async with self._read() as db, db.execute(
+                "SELECT * FROM GuildSettings WHERE guildId = ?;", (guild_id,)) as cursor:
             if data := await cursor.fetchone():
                 return GuildSettings(*data)
             return GuildSettings(
@@ -181,8 +440,9 @@ class Database:  # aiosqlite3
         :return: None
         """
 
-        async with self._db.execute("REPLACE INTO GuildSettings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);", (*settings,)):
-            await self._db.commit()
+        async with self._write() as db, db.execute(
+                "REPLACE INTO GuildSettings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);", (*settings,)):
+            await db.commit()
 
     async def remove_guild_settings(self, guild_id: int) -> None:
         """
@@ -191,8 +451,8 @@ class Database:  # aiosqlite3
         :return: None
         """
 
-        async with self._db.execute("DELETE FROM GuildSettings WHERE guildId = ?;", (guild_id,)):
-            await self._db.commit()
+        async with self._write() as db, db.execute("DELETE FROM GuildSettings WHERE guildId = ?;", (guild_id,)):
+            await db.commit()
 
     async def get_user_stats(self, user_id: int) -> UserStats:
         """
@@ -201,7 +461,7 @@ class Database:  # aiosqlite3
         :return: UserStats
         """
 
-        async with self._db.execute(
+        async with self._read() as db, db.execute(
                 "SELECT * FROM UserStats WHERE userId = ?;", (user_id,)) as cursor:
             if data := await cursor.fetchone():
                 return UserStats(*data)
@@ -215,9 +475,114 @@ class Database:  # aiosqlite3
         """
 
         if not stats:
-            async with self._db.execute("DELETE FROM UserStats WHERE userId = ?;", (stats.user_id,)):
-                await self._db.commit()
+            async with self._write() as db, db.execute("DELETE FROM UserStats WHERE userId = ?;", (stats.user_id,)):
+                await db.commit()
             return
 
-        async with self._db.execute("REPLACE INTO UserStats VALUES (?, ?, ?, ?);", (*stats,)):
-            await self._db.commit()
+        async with self._write() as db, db.execute("REPLACE INTO UserStats VALUES (?, ?, ?, ?);", (*stats,)):
+            await db.commit()
+
+    async def get_track_resolution(self, spotify_id: str, ttl: int) -> TrackResolution | None:
+        """
+        Gets the cached resolution of a Spotify track.
+        :param spotify_id: The Spotify ID of the track.
+        :param ttl: The maximum age of the resolution in seconds.
+        :return: TrackResolution or None if not cached or expired.
+        """
+
+        async with self._read() as db, db.execute(
+                "SELECT * FROM TrackResolutions WHERE spotifyId = ? AND resolvedAt > ?;",
+                (spotify_id, int(time()) - ttl)) as cursor:
+            if data := await cursor.fetchone():
+                spotify_id, url, metadata, resolved_at = data
+                return TrackResolution(spotify_id, url, loads(metadata), resolved_at)
+
+    async def set_track_resolution(self, resolution: TrackResolution) -> None:
+        """
+        Caches the resolution of a Spotify track.
+        :param resolution: The resolution to cache.
+        :return: None
+        """
+
+        async with self._write() as db, db.execute(
+                "REPLACE INTO TrackResolutions VALUES (?, ?, ?, ?);",
+                (resolution.spotify_id, resolution.url, dumps(resolution.data), resolution.resolved_at)):
+            await db.commit()
+
+    async def remove_track_resolution(self, spotify_id: str) -> None:
+        """
+        Removes the cached resolution of a Spotify track, e.g. once its page became unavailable.
+        :param spotify_id: The Spotify ID of the track.
+        :return: None
+        """
+
+        async with self._write() as db, db.execute(
+                "DELETE FROM TrackResolutions WHERE spotifyId = ?;", (spotify_id,)):
+            await db.commit()
+
+    async def get_stream_url(self, url: str, min_lifetime: int = 0) -> StreamUrl | None:
+        """
+        Gets the cached stream URL of a page.
+        :param url: The URL of the page.
+        :param min_lifetime: How many seconds the stream URL has to stay valid at least.
+        :return: StreamUrl or None if not cached or expiring too soon.
+        """
+
+        async with self._read() as db, db.execute(
+                "SELECT * FROM StreamUrls WHERE url = ? AND expiresAt > ?;", (url, int(time()) + min_lifetime)
+        ) as cursor:
+            if data := await cursor.fetchone():
+                return StreamUrl(*data)
+
+    async def set_stream_url(self, stream_url: StreamUrl) -> None:
+        """
+        Caches the stream URL of a page.
+        :param stream_url: The stream URL to cache.
+        :return: None
+        """
+
+        async with self._write() as db, db.execute("REPLACE INTO StreamUrls VALUES (?, ?, ?);", (*stream_url,)):
+            await db.commit()
+
+    async def get_spotify_cache_entry(self, key: str) -> SpotifyCacheEntry | None:
+        """
+        Gets a cached Spotify API response. Expiry is left to the caller, stale entries can still be revalidated.
+        :param key: The kind and Spotify ID of the object.
+        :return: SpotifyCacheEntry or None if not cached.
+        """
+
+        async with self._read() as db, db.execute("SELECT * FROM SpotifyCache WHERE key = ?;", (key,)) as cursor:
+            if data := await cursor.fetchone():
+                key, response, etag, cached_at = data
+                return SpotifyCacheEntry(key, loads(response), etag, cached_at)
+
+    async def get_spotify_cache_entries(self, keys: list[str]) -> dict[str, SpotifyCacheEntry]:
+        """
+        Gets several cached Spotify API responses, with one query per MAX_PARAMETERS keys.
+        :param keys: The kinds and Spotify IDs of the objects.
+        :return: The cached entries by key, keys that are not cached are left out.
+        """
+
+        entries: dict[str, SpotifyCacheEntry] = {}
+        async with self._read() as db:
+            for i in range(0, len(keys), self.MAX_PARAMETERS):
+                chunk: list[str] = keys[i:i + self.MAX_PARAMETERS]
+                async with db.execute(
+                        f"SELECT * FROM SpotifyCache WHERE key IN ({', '.join('?' * len(chunk))});", chunk) as cursor:
+                    for key, response, etag, cached_at in await cursor.fetchall():
+                        entries[key] = SpotifyCacheEntry(key, loads(response), etag, cached_at)
+        return entries
+
+    async def set_spotify_cache_entries(self, entries: list[SpotifyCacheEntry]) -> None:
+        """
+        Caches several Spotify API responses in a single transaction.
+        :param entries: The entries to cache.
+        :return: None
+        """
+
+        async with self._write() as db:
+            await db.executemany(
+                "REPLACE INTO SpotifyCache VALUES (?, ?, ?, ?);",
+                [(entry.key, dumps(entry.data), entry.etag, entry.cached_at) for entry in entries]
+            )
+            await db.commit()
@@ -1,4 +1,5 @@
 from dataclasses import dataclass, asdict
+from typing import Any
 
 from lib.enums import SongEmbedSize
 
@@ -111,3 +112,70 @@ class UserStats:
 
     def __iter__(self):
         yield from asdict(self).values()
+
+
+@dataclass
+class TrackResolution:
+    """
+    Represents a Spotify track resolved to a playable page.
+
+    :ivar spotify_id: The Spotify ID of the track.
+    :ivar url: The URL of the page the track was resolved to.
+    :ivar data: The metadata of the resolved page.
+    :ivar resolved_at: The UNIX timestamp of the resolution.
+    """
+
+    spotify_id: str
+    url: str
+    data: dict[str, Any]
+    resolved_at: int
+
+    def __bool__(self):
+        return True
+
+    def __iter__(self):
+        yield from asdict(self).values()
+
+
+@dataclass
+class StreamUrl:
+    """
+    Represents a cached stream URL of a page.
+
+    :ivar url: The URL of the page.
+    :ivar stream_url: The URL of the audio stream.
+    :ivar expires_at: The UNIX timestamp at which the stream URL expires.
+    """
+
+    url: str
+    stream_url: str
+    expires_at: int
+
+    def __bool__(self):
+        return True
+
+    def __iter__(self):
+        yield from asdict(self).values()
+
+
+@dataclass
+class SpotifyCacheEntry:
+    """
+    Represents a cached Spotify API response.
+
+    :ivar key: The kind and Spotify ID of the object, e.g. ``playlist:37i9dQZF1DXcBWIGoYBM5M``.
+    :ivar data: The response of the Spotify API.
+    :ivar etag: The ETag of the response, if any.
+    :ivar cached_at: The UNIX timestamp at which the response was fetched or last revalidated.
+    """
+
+    key: str
+    data: dict[str, Any]
+    etag: str | None
+    cached_at: int
+
+    def __bool__(self):
+        return True
+
+    def __iter__(self):
+        yield from asdict(self).values()
@@ -12,3 +12,19 @@ class NotEnoughVotes(Exception):
     def __init__(self, message: str = "Not enough votes to skip.") -> None:
         self.message = message
         super().__init__(self.message)
+
+
+class ExtractionQueueFull(Exception):
+    """Exception raised when too many extractions are waiting for the extraction executor."""
+
+    def __init__(self, message: str = "Too many extractions are queued.") -> None:
+        self.message = message
+        super().__init__(self.message)
+
+
+class ExtractionTimeout(Exception):
+    """Exception raised when an extraction took too long."""
+
+    def __init__(self, message: str = "The extraction timed out.") -> None:
+        self.message = message
+        super().__init__(self.message)
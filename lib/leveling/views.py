@@ -0,0 +1,42 @@
+from discord import Interaction, ButtonStyle
+from discord.ui import View, Button
+
+from lib.contexts import CustomApplicationContext
+from lib.db.db_classes import Emoji
+from lib.utils import random_hex
+
+
+class LeaderboardPages(View):
+    def __init__(self, ctx: CustomApplicationContext) -> None:
+        super().__init__(timeout=60)
+        self.ctx = ctx
+        self.value = False  # Whether the next page was requested
+
+        self.add_item(
+            Button(
+                style=ButtonStyle.blurple,
+                label='Next Page',
+                custom_id=random_hex(8)
+            )
+        )
+
+    async def interaction_check(self, interaction: Interaction) -> bool:
+        if interaction.user.id == self.ctx.author.id:
+            self.disable_all_items()
+            self.value = True
+            await interaction.response.edit_message(view=None)
+            self.stop()
+            return True
+        return False
+
+    async def on_check_failure(self, interaction: Interaction) -> None:
+        emoji_cross: Emoji = await self.ctx.bot.database.get_emoji("cross")
+        await interaction.response.send_message(
+            f'{emoji_cross} Only the command author can use this.',
+            ephemeral=True
+        )
+
+    async def on_timeout(self) -> None:
+        self.disable_all_items()
+        if self.message is not None:
+            await self.message.edit(view=None)
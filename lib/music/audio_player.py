@@ -1,19 +1,20 @@
-from asyncio import wait_for, TimeoutError, Event, QueueFull, sleep
+from asyncio import Event, QueueFull, Task
 from collections import deque
 from math import floor
+from time import time
 from typing import Iterator, Callable
 
-from discord import VoiceClient, HTTPException, Forbidden, Message, FFmpegPCMAudio, InteractionMessage, NotFound, Member
+from discord import VoiceClient, HTTPException, Forbidden, Message, InteractionMessage, NotFound, Member
 
 from lib.contexts import CustomApplicationContext
 from lib.db.db_classes import Emoji, UserStats
 from lib.enums import AudioPlayerLoopMode, SongEmbedSize
-from lib.exceptions import NotEnoughVotes
+from lib.exceptions import NotEnoughVotes, ExtractionQueueFull, ExtractionTimeout
 from lib.logging import log, save_traceback
 from lib.music.extraction import YTDLSource
 from lib.music.queue import SongQueue
+from lib.music.scheduler import IdleScheduler
 from lib.music.song import Song
-from lib.spotify.track import Track
 
 
 class AudioPlayer:
@@ -22,10 +23,15 @@ class AudioPlayer:
     _queue: SongQueue[Song]
     _message: Message | InteractionMessage | None
     _votes: dict[Callable[[], None], set[int]]
+    _prefetch: dict[int, tuple[Song, Task[bool]]]
 
-    def __init__(self, ctx: CustomApplicationContext) -> None:
+    IDLE_TIMEOUT = 180  # Seconds without a song to play before leaving
+    ALONE_TIMEOUT = 60  # Seconds without anyone to listen before leaving
+
+    def __init__(self, ctx: CustomApplicationContext, scheduler: IdleScheduler) -> None:
         self.ctx = ctx
-        self._queue = SongQueue(maxsize=200)
+        self._scheduler = scheduler
+        self._queue = SongQueue(maxsize=ctx.bot.settings['Music']['QueueSize'])
 
         self._voice = None
         self._votes = {}
@@ -36,9 +42,21 @@ class AudioPlayer:
         self._event = Event()
         self._history = deque(maxlen=5)
         self._embed_size = None
+        self._going_back = False
+
+        # Background resolution of the upcoming songs, keyed by id(song)
+        self._prefetch = {}
+        self._prefetch_window = ctx.bot.settings['Music']['PrefetchWindow']
+        self._prefetch_refresh_margin = ctx.bot.settings['Music']['PrefetchRefreshMargin']
+        self._prefetch_hits = 0
+        self._prefetch_misses = 0
+        self._stale_refreshes = 0
+
+        # Loop times since when the player waits for a song and nobody listens, leaving once either lasts too long
+        self._waiting_since = None
+        self._alone_since = None
 
         self._player_task = ctx.bot.loop.create_task(self._player())
-        self._inactivity_check_task = ctx.bot.loop.create_task(self._inactivity_check())
 
     def __del__(self) -> None:
         self._cleanup()
@@ -59,6 +77,7 @@ class AudioPlayer:
 
     def __reversed__(self) -> None:
         reversed(self._queue)
+        self._schedule_prefetch()
 
     @property
     def active(self) -> bool:
@@ -116,6 +135,28 @@ class AudioPlayer:
         """
         return self._queue.duration
 
+    @property
+    def prefetch_hits(self) -> int:
+        """
+        :returns: The number of songs that were already resolved in the background when they were due.
+        """
+        return self._prefetch_hits
+
+    @property
+    def prefetch_misses(self) -> int:
+        """
+        :returns: The number of songs the player had to wait for to be resolved.
+        """
+        return self._prefetch_misses
+
+    @property
+    def stale_refreshes(self) -> int:
+        """
+        :returns: The number of songs whose expired stream URL was renewed right before playing,
+        each one a playback failure avoided.
+        """
+        return self._stale_refreshes
+
     @property
     def history(self) -> deque[Song]:
         """
@@ -154,6 +195,22 @@ class AudioPlayer:
         """
         return self._queue.full()
 
+    @property
+    def free(self) -> int:
+        """
+        The number of songs that can still be added to the queue.
+
+        :return: The number of free slots.
+        """
+        return self._queue.maxsize - len(self._queue)
+
+    def requests_of(self, member_id: int) -> int:
+        """
+        :param member_id: The ID of a member.
+        :return: The number of queued songs the member requested.
+        """
+        return self._queue.count(member_id)
+
     @property
     def live(self) -> bool:
         """
@@ -184,78 +241,117 @@ class AudioPlayer:
         """
         self._embed_size = value
 
-    async def _inactivity_check(self) -> None:
+    def update_listeners(self) -> None:
         """
-        Checks if the bot is alone in the voice channel.
-        If it is, it will leave directly.
+        Checks whether anyone besides bots is left in the voice channel, to be called on voice state changes.
+        Leaves after ALONE_TIMEOUT seconds without listeners.
 
         :return: None
         """
 
-        while True:
-            await sleep(60)
-            if not self.active:
-                await self.send(f"**Left** {self.voice.channel.mention} **due to inactivity**.")
-                return self._cleanup()
-            
+        try:
+            alone: bool = not any(not member.bot for member in self.voice.channel.members)
+        except AttributeError:
+            alone: bool = True
+
+        if not alone:
+            self._alone_since = None
+        elif self._alone_since is None:
+            self._alone_since = self.ctx.bot.loop.time()
+        self._update_idle()
+
+    def _update_idle(self) -> None:
+        """
+        Moves the idle deadline of the player to the earliest of its running timeouts, or removes it.
+        :return: None
+        """
+
+        deadlines: list[float] = []
+        if self._waiting_since is not None:
+            deadlines.append(self._waiting_since + self.IDLE_TIMEOUT)
+        if self._alone_since is not None:
+            deadlines.append(self._alone_since + self.ALONE_TIMEOUT)
+
+        if deadlines:
+            self._scheduler.schedule(self, min(deadlines), self._idle)
+        else:
+            self._scheduler.cancel(self)
+
+    def _idle(self) -> None:
+        self.ctx.bot.loop.create_task(self._leave())
+
+    async def _leave(self) -> None:
+        """
+        Leaves the voice channel due to inactivity.
+        :return: None
+        """
+
+        if self.active:
             try:
-                member_amount = len([member for member in self.voice.channel.members if not member.bot])
-                if not member_amount:
-                    raise AttributeError
-            except AttributeError:
                 await self.send(f"**Left** {self.voice.channel.mention} **due to inactivity**.")
-                return self._cleanup()
+            except AttributeError:
+                pass
+        self._cleanup()
 
     async def _player(self) -> None:
         self._embed_size = (await self.ctx.bot.database.get_guild_settings(self.ctx.guild.id)).song_embed_size
 
         while True:
             self._event.clear()
+            going_back, self._going_back = self._going_back, False  # back() already requeued the current song
 
             #  Add the previous song to queue if loop is enabled
-            if self.loop and self.current:
-                self.reset_ffmpeg(self.current)  # Reset the current song, so it can be played again
+            if self.loop and self.current and not going_back:
+                self.current.source.reset()  # Reset the current song, so it can be played again
 
                 try:
                     if self._loop == AudioPlayerLoopMode.QUEUE:
-                        self._queue.put_nowait(self.current)
+                        self._queue.put_nowait(self.current.detached())  # Materialized again when it comes up
                     else:
                         self._queue.insert(0, self.current)
+                    self._schedule_prefetch()
                 except QueueFull:
                     emoji_attention: Emoji = await self.ctx.bot.database.get_emoji("attention")
                     await self.send(f"{emoji_attention} **Queue is full**, ignoring loop.")
 
             # Add the song to the history
-            if self.current and self.current not in self.history:
+            if self.current and not going_back and self.current not in self.history:
                 self.history.append(self.current)
 
-            #  Waiting for the next song, leaving if there is no song in 3 minutes
+            #  Waiting for the next song, the idle scheduler leaves if there is none in IDLE_TIMEOUT seconds
             self._current = None
             self.message = None
-            try:
-                song: Song = await wait_for(self._queue.get(), timeout=180)
-            except TimeoutError:
-                if self.active:
-                    try:
-                        await self.send(f"**Left** {self.voice.channel.mention} **due to inactivity**.")
-                    except AttributeError:
-                        pass
-                self._cleanup()
-                break
+            self._waiting_since = self.ctx.bot.loop.time()
+            self._update_idle()
+            song: Song = await self._queue.get()
+            self._waiting_since = None
+            self._update_idle()
 
             if not self.active:
                 break
 
-            #  Convert the track to a playable source
-            if isinstance(song.source, Track):
-                try:
-                    source = await YTDLSource.from_track(song.requester, song.source, loop=self.ctx.bot.loop)
-                except ValueError:
-                    continue
-                except Exception as e:
-                    await save_traceback(e)
+            #  Take over the background resolution of the song and start resolving the following ones
+            _, task = self._prefetch.pop(id(song), (song, None))
+            if task is not None and task.cancelled():
+                task = None
+            self._schedule_prefetch()
+
+            #  Convert the track to a playable source, waiting for the prefetch if it is still running
+            if not song.resolved or (task is not None and not task.done()):
+                self._prefetch_misses += 1
+                resolved: bool = await task if task is not None else False
+                if not resolved and not await self._resolve(song):  # A failed prefetch is tried once more
+                    await self._report_unplayable(song)
                     continue
-                song = Song(source)
+            elif task is not None and song.source.expired:
+                self._prefetch_misses += 1  # Prefetched, but not fresh enough
+            elif task is not None:
+                self._prefetch_hits += 1
+
+            #  The stream URL may have expired while the song waited, e.g. in a long queue or a loop
+            if song.source.expired and not await self._refresh(song):
+                await self._report_unplayable(song)
+                continue
 
             # Play the song
             self._voice.play(song.source, after=self._prepare_next)
@@ -279,8 +375,6 @@ class AudioPlayer:
                 user_stats.songs_minutes += song.duration
                 await self.ctx.bot.database.set_user_stats(user_stats)
 
-            # Process the next song in the queue to minimize the delay
-            await self._process_next()
             await self._event.wait()  # Wait for the song to end
 
     def put(self, song: Song, index: int = None) -> None:
@@ -295,8 +389,24 @@ class AudioPlayer:
         """
 
         if index is not None:
-            return self._queue.insert(index, song)
-        self._queue.put_nowait(song)
+            self._queue.insert(index, song)
+        else:
+            self._queue.put_nowait(song)
+        self._release_outside_window([song])
+        self._schedule_prefetch()
+
+    def extend(self, songs: list[Song]) -> None:
+        """
+        Put several songs at the end of the queue at once.
+        :param songs: The songs to put in the queue
+
+        :return: None
+
+        :raises asyncio.QueueFull: If not all songs fit into the queue
+        """
+        self._queue.extend(songs)
+        self._release_outside_window(songs)
+        self._schedule_prefetch()
 
     def clear(self) -> None:
         """
@@ -304,6 +414,7 @@ class AudioPlayer:
         :return: None
         """
         self._queue.clear()
+        self._schedule_prefetch()
 
     def skip(self) -> None:
         """
@@ -320,36 +431,32 @@ class AudioPlayer:
     def back(self) -> None:
         """
         Go back to the previous song.
+        It is queued in front of the current song, which is stopped and played again afterwards.
+        The player renews the stream URL of the previous song if it expired.
         :return: None
 
         :raises asyncio.QueueFull: If the queue is full
         :raises ValueError: If there is no previous song in history
         """
+        if self.history and self.history[-1] is self.current:
+            self.history.pop()  # Looping the current song added it to the history, it is not a previous song
         if not len(self.history):
             raise ValueError("No previous song in history")
 
-        if self._queue.full():
+        playing: bool = self.current is not None and self.voice is not None \
+            and (self.voice.is_playing() or self.voice.is_paused())
+        if self._queue.maxsize > 0 and len(self._queue) + 1 + playing > self._queue.maxsize:
             raise QueueFull("Queue is full.")
 
         previous: Song = self.history.pop()
-        self.reset_ffmpeg(previous)  # Reset the stream so the source can be played again
-        self.voice.source = previous.source  # Replace the current song with the previous one
-
-        self.reset_ffmpeg(self.current)
-        self._queue.insert(0, self.current)
+        if playing:
+            self._queue.insert(0, self.current)
+            self._going_back = True  # The player neither loops the stopped song nor adds it to the history
+        self._queue.insert(0, previous)
+        self._schedule_prefetch()
 
-        self._timestamp = int(self.voice.timestamp / 1000 * 0.02)  # Update the timestamp
-        self._current = previous
-
-        async def _send() -> None:
-            message: Message = await self.send(embed=previous.get_embed(
-                loop=self.loop,
-                queue=list(self._queue),
-                size=SongEmbedSize(self.embed_size),
-                progress=0
-            ))
-            self.message = message
-        self.ctx.bot.loop.create_task(_send())  # Send the message
+        if playing:
+            self.voice.stop()
 
     def pause(self) -> None:
         """
@@ -373,6 +480,7 @@ class AudioPlayer:
         :return: None
         """
         self._queue.clear()
+        self._schedule_prefetch()
         self._loop = AudioPlayerLoopMode.NONE
         if self.voice:
             self.voice.stop()
@@ -383,6 +491,7 @@ class AudioPlayer:
         :return: None
         """
         self._queue.shuffle()
+        self._schedule_prefetch()
 
     def remove(self, index: int) -> None:
         """
@@ -394,6 +503,41 @@ class AudioPlayer:
         :raises IndexError: If the index is out of range
         """
         del self._queue[index]
+        self._schedule_prefetch()
+
+    def remove_range(self, start: int, stop: int) -> list[Song]:
+        """
+        Remove a range of songs from the queue
+        :param start: The index of the first song to remove
+        :param stop: The index after the last song to remove
+
+        :return: The removed songs
+        """
+        removed: list[Song] = self._queue.remove_range(start, stop)
+        self._schedule_prefetch()
+        return removed
+
+    def move(self, index: int, destination: int) -> None:
+        """
+        Move a song to another position in the queue
+        :param index: The index of the song to move
+        :param destination: The new index of the song
+
+        :return: None
+
+        :raises IndexError: If the index is out of range
+        """
+        self._queue.move(index, destination)
+        self._schedule_prefetch()
+
+    def dedupe(self) -> int:
+        """
+        Remove songs that are already queued further ahead
+        :return: The number of removed songs
+        """
+        removed: int = self._queue.dedupe()
+        self._schedule_prefetch()
+        return removed
 
     def reverse(self) -> None:
         """
@@ -401,6 +545,7 @@ class AudioPlayer:
         :return: None
         """
         reversed(self._queue)
+        self._schedule_prefetch()
 
     def leave(self) -> None:
         self._cleanup()
@@ -459,22 +604,13 @@ class AudioPlayer:
         except (Forbidden, HTTPException):
             pass
 
-    @staticmethod
-    def reset_ffmpeg(song: Song) -> None:
-        """
-        Reset a song to its original streaming state.
-
-        :param song: The song to reset
-        :return: None
-        """
-        song.source.original = FFmpegPCMAudio(
-            song.source.stream_url, **YTDLSource.FFMPEG_OPTIONS
-        )
-
     def _cleanup(self) -> None:
         self._queue.clear()
+        for _, task in self._prefetch.values():
+            task.cancel()
+        self._prefetch.clear()
         self._player_task.cancel()
-        self._inactivity_check_task.cancel()
+        self._scheduler.cancel(self)
         self.message = None
 
         if self._voice:
@@ -489,16 +625,83 @@ class AudioPlayer:
             self._votes[self.skip].clear()
         self._event.set()
 
-    async def _process_next(self) -> None:
-        if len(self._queue) and self.loop != AudioPlayerLoopMode.SONG:
-            next_song = self._queue[0]
-            if isinstance(next_song.source, Track):
-                try:
-                    source = await YTDLSource.from_track(next_song.requester, next_song.source, loop=self.ctx.bot.loop)
-                except ValueError:
-                    del self._queue[0]
-                except Exception as e:
-                    await save_traceback(e)
-                    del self._queue[0]
-                else:
-                    next_song.source = source
+    def _release_outside_window(self, songs: list[Song]) -> None:
+        """
+        Drops the sources of newly queued songs that are not about to be played, e.g. songs queued from a URL.
+        Only their compact entries are kept until they reach the prefetch window.
+
+        :param songs: The newly queued songs.
+        :return: None
+        """
+
+        window: set[int] = {id(song) for song in self._queue[:self._prefetch_window]}
+        for song in songs:
+            if id(song) not in window:
+                song.release()
+
+    def _schedule_prefetch(self) -> None:
+        """
+        Resolves the songs in the prefetch window in the background.
+        Unresolved tracks are resolved, stream URLs that are about to expire are re-resolved.
+        Resolutions of songs that left the window, e.g. due to a shuffle or clear, are cancelled.
+
+        :return: None
+        """
+
+        window: list[Song] = self._queue[:self._prefetch_window]
+        keys: set[int] = {id(song) for song in window}
+        for key in [key for key in self._prefetch if key not in keys]:
+            song, task = self._prefetch.pop(key)
+            task.cancel()
+            if all(song is not played for played in self.history):
+                song.release()  # Only the compact entry is kept until it comes up again
+
+        for song in window:
+            # Running, or failed, a failed song is tried once more when it comes up
+            entry: tuple[Song, Task[bool]] | None = self._prefetch.get(id(song))
+            if entry and (not entry[1].done() or not song.resolved):
+                continue
+
+            if not song.resolved or song.source.expires_at - time() < self._prefetch_refresh_margin:
+                self._prefetch[id(song)] = (song, self.ctx.bot.loop.create_task(self._resolve(song)))
+
+    async def _report_unplayable(self, song: Song) -> None:
+        emoji_cross: Emoji = await self.ctx.bot.database.get_emoji("cross")
+        await self.send(f"{emoji_cross} **Could not play** `{song.title}`, **skipping**.")
+
+    async def _refresh(self, song: Song) -> bool:
+        """
+        Renews the expired stream URL of a song.
+
+        :param song: The song to refresh.
+        :return: Whether the song got a fresh source.
+        """
+
+        if not await self._resolve(song) or song.source.expired:
+            return False
+        self._stale_refreshes += 1
+        return True
+
+    async def _resolve(self, song: Song) -> bool:
+        """
+        Resolves a song to a fresh playable source.
+
+        :param song: The song to resolve.
+        :return: Whether the song is playable.
+        """
+
+        try:
+            # Cached stream URLs about to expire would only be prefetched again
+            source: YTDLSource = await song.materialize(
+                loop=self.ctx.bot.loop, database=self.ctx.bot.database, min_lifetime=self._prefetch_refresh_margin
+            )
+        except (ValueError, ExtractionQueueFull, ExtractionTimeout):
+            return song.resolved
+        except Exception as e:
+            await save_traceback(e)
+            return song.resolved
+
+        song.release()  # Stop the stale ffmpeg process
+        song.source = source
+        self._queue.refresh(song)  # The duration of a resolved track or search may differ
+        return True
@@ -1,11 +1,96 @@
+from asyncio import Task, wait, shield, get_running_loop, TimeoutError, wait_for
+from collections import OrderedDict
+from time import time
 from urllib.parse import urlparse
 
 from lib.contexts import CustomAutocompleteContext
+from lib.spotify.exceptions import SpotifyException
+
+CACHE_SIZE = 1024  # Number of cached queries
+CACHE_TTL = 600  # Seconds a cached result is used without asking Spotify again
+RESPONSE_TIMEOUT = 2.5  # Discord drops autocomplete responses after 3 seconds
+
+# normalized query: (timestamp, results)
+_cache: OrderedDict[str, tuple[float, list[str]]] = OrderedDict()
+
+# user id: search task of the user's latest keystroke
+_pending: dict[int, Task[list[str]]] = {}
+
+
+def _normalize(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _get_cached(query: str, stale: bool = False) -> list[str] | None:
+    """
+    Gets the cached results of a query.
+
+    :param query: The normalized query.
+    :param stale: Whether expired results may be returned.
+    :return: The results or None if not cached.
+    """
+
+    try:
+        timestamp, results = _cache[query]
+    except KeyError:
+        return None
+
+    if not stale and time() - timestamp > CACHE_TTL:
+        return None
+    _cache.move_to_end(query)
+    return results
+
+
+def _set_cached(query: str, results: list[str]) -> None:
+    _cache[query] = (time(), results)
+    _cache.move_to_end(query)
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def _get_prefix_cached(query: str, stale: bool = False) -> list[str] | None:
+    """
+    Reuses the cached results of the longest cached prefix of a query,
+    filtered to the results that still match every word of the query.
+
+    :param query: The normalized query.
+    :param stale: Whether expired results may be returned.
+    :return: The filtered results or None if no prefix yields a match.
+    """
+
+    tokens: list[str] = query.split()
+    for end in range(len(query) - 1, 3, -1):
+        if (results := _get_cached(query[:end], stale)) is None:
+            continue
+
+        filtered: list[str] = [
+            result for result in results
+            if all(any(word.startswith(token) for word in result.lower().split()) for token in tokens)
+        ]
+        return filtered or None
+    return None
+
+
+def _done(user_id: int, task: Task[list[str]]) -> None:
+    if _pending.get(user_id) is task:
+        del _pending[user_id]
+    if not task.cancelled():
+        task.exception()  # Retrieved here, as a timed out caller does not await the task anymore
+
+
+async def _search(ctx: CustomAutocompleteContext, query: str) -> list[str]:
+    results: list[str] = [
+        f"{track.name} {track.artists[0]}"[:100] async for track in ctx.bot.spotify.search(query, limit=10)
+    ]
+    _set_cached(query, results)
+    return results
 
 
 async def complete(ctx: CustomAutocompleteContext) -> list[str]:
     """
     Autocomplete for the /play and /playnext command.
+    Results are cached by query and reused for longer queries while typing.
+    Only one Spotify search per user runs at a time.
 
     :param ctx: The context of the command.
     :return: A list of possible completions.
@@ -21,8 +106,30 @@ async def complete(ctx: CustomAutocompleteContext) -> list[str]:
         for playlist in await ctx.bot.spotify.get_trending_playlists():
             results.append(f"Playlist: {playlist.name}")
         return results
-    
+
     # Check if the value is any url
     if urlparse(value).scheme in ["http", "https"]:
         return []
-    return [f"{track.name} {track.artists[0]}"[:100] async for track in ctx.bot.spotify.search(value, limit=10)]
+
+    query: str = _normalize(value)
+    if (results := _get_cached(query)) is not None or (results := _get_prefix_cached(query)) is not None:
+        return results
+
+    deadline: float = get_running_loop().time() + RESPONSE_TIMEOUT
+    user_id: int = ctx.interaction.user.id
+
+    # Wait for the search of the previous keystroke, its results may already cover this query
+    if (previous := _pending.get(user_id)) and not previous.done():
+        await wait((previous,), timeout=deadline - get_running_loop().time())
+        if (results := _get_cached(query)) is not None or (results := _get_prefix_cached(query)) is not None:
+            return results
+
+    task: Task[list[str]] = get_running_loop().create_task(_search(ctx, query))
+    _pending[user_id] = task
+    task.add_done_callback(lambda t: _done(user_id, t))
+
+    try:
+        # Shielded, so a late response still fills the cache for the next keystroke
+        return await wait_for(shield(task), timeout=max(deadline - get_running_loop().time(), 0))
+    except (TimeoutError, SpotifyException):
+        return _get_cached(query, stale=True) or _get_prefix_cached(query, stale=True) or []
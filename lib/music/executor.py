@@ -0,0 +1,184 @@
+from asyncio import Future, TimeoutError, get_running_loop, wait_for
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from multiprocessing import get_context
+from time import perf_counter
+from typing import Any, Callable
+
+from lib.exceptions import ExtractionQueueFull, ExtractionTimeout
+
+
+@dataclass(slots=True)
+class _Job:
+    func: Callable[..., Any]
+    args: tuple[Any, ...]
+    future: Future
+    enqueued_at: float = field(default_factory=perf_counter)
+
+
+class ExtractionExecutor:
+    """
+    A bounded pool for yt-dlp extractions, separate from the default executor of the event loop.
+    Waiting extractions are handed out round-robin per guild, so one guild queueing a large playlist
+    does not starve the others.
+
+    In process mode, extractor parsing runs outside the bot process and does not hold the GIL of the event loop.
+    Submitted functions and their arguments must then be picklable, i.e. module-level functions.
+    """
+
+    def __init__(self, workers: int = 4, max_queued: int = 64, timeout: float = 30, processes: bool = False) -> None:
+        self._workers = workers
+        self._max_queued = max_queued
+        self._timeout = timeout
+        self._processes = processes
+        self._pool = None
+
+        # guild id: waiting jobs of the guild, guilds with waiting jobs in round-robin order
+        self._pending: dict[int, deque[_Job]] = {}
+        self._order: deque[int] = deque()
+        self._queued = 0
+        self._running = 0
+
+        self._dispatched = 0
+        self._completed = 0
+        self._queue_wait = 0.0
+        self._run_time = 0.0
+
+    @property
+    def pool(self) -> Executor:
+        """
+        The underlying pool, created on first use.
+        Worker processes are spawned rather than forked, the bot process runs several threads.
+        :return: The pool.
+        """
+
+        if self._pool is None:
+            if self._processes:
+                self._pool = ProcessPoolExecutor(self._workers, mp_context=get_context("spawn"))
+            else:
+                self._pool = ThreadPoolExecutor(self._workers, thread_name_prefix="extraction")
+        return self._pool
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def queued(self) -> int:
+        """
+        :return: The number of extractions waiting for a worker.
+        """
+        return self._queued
+
+    @property
+    def running(self) -> int:
+        """
+        :return: The number of extractions occupying a worker.
+        """
+        return self._running
+
+    @property
+    def average_queue_wait(self) -> float:
+        """
+        :return: The average time in seconds an extraction waited for a worker.
+        """
+        return self._queue_wait / self._dispatched if self._dispatched else 0.0
+
+    @property
+    def average_run_time(self) -> float:
+        """
+        :return: The average time in seconds an extraction ran.
+        """
+        return self._run_time / self._completed if self._completed else 0.0
+
+    async def run(self, guild_id: int, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Runs a blocking function in the pool.
+        The timeout covers waiting and running. A timed out function that is already running keeps its worker
+        until it returns, as threads cannot be interrupted.
+
+        :param guild_id: The ID of the guild the extraction is for.
+        :param func: The function to run.
+        :param args: The arguments of the function.
+        :return: The return value of the function.
+
+        :raises ExtractionQueueFull: If too many extractions are waiting.
+        :raises ExtractionTimeout: If the extraction did not finish in time.
+        """
+
+        if self._queued >= self._max_queued:
+            raise ExtractionQueueFull()
+
+        job: _Job = _Job(func, args, get_running_loop().create_future())
+        if guild_id not in self._pending:
+            self._pending[guild_id] = deque()
+            self._order.append(guild_id)
+        self._pending[guild_id].append(job)
+        self._queued += 1
+        self._dispatch()
+
+        try:
+            return await wait_for(job.future, self._timeout)
+        except TimeoutError:
+            raise ExtractionTimeout() from None
+
+    def _dispatch(self) -> None:
+        """
+        Hands waiting jobs to free workers, one guild after another.
+        :return: None
+        """
+
+        while self._running < self._workers and self._order:
+            guild_id: int = self._order.popleft()
+            jobs: deque[_Job] = self._pending[guild_id]
+            job: _Job = jobs.popleft()
+            if jobs:
+                self._order.append(guild_id)
+            else:
+                del self._pending[guild_id]
+            self._queued -= 1
+
+            if job.future.done():  # Timed out or cancelled while waiting
+                continue
+
+            started: float = perf_counter()
+            self._running += 1
+            self._dispatched += 1
+            self._queue_wait += started - job.enqueued_at
+
+            pool_future: Future = get_running_loop().run_in_executor(self.pool, job.func, *job.args)
+            pool_future.add_done_callback(partial(self._finished, job, started))
+
+    def _finished(self, job: _Job, started: float, pool_future: Future) -> None:
+        self._running -= 1
+        self._completed += 1
+        self._run_time += perf_counter() - started
+
+        if pool_future.cancelled():
+            job.future.cancel()
+        elif job.future.done():
+            pool_future.exception()  # Retrieved here, nobody waits for a timed out job anymore
+        elif exception := pool_future.exception():
+            job.future.set_exception(exception)
+        else:
+            job.future.set_result(pool_future.result())
+        self._dispatch()
+
+    def shutdown(self) -> None:
+        """
+        Stops the pool. Running extractions are abandoned, waiting ones are cancelled.
+        :return: None
+        """
+
+        for jobs in self._pending.values():
+            for job in jobs:
+                job.future.cancel()
+        self._pending.clear()
+        self._order.clear()
+        self._queued = 0
+
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -1,19 +1,73 @@
 from asyncio import AbstractEventLoop
 from datetime import datetime
+from itertools import islice
 from re import sub
+from time import time
 from typing import Self
-from urllib.parse import quote
+from urllib.parse import quote, urlparse, parse_qs
 
-from discord import PCMVolumeTransformer, FFmpegPCMAudio, Member
-from yt_dlp import YoutubeDL
+from discord import AudioSource, PCMVolumeTransformer, FFmpegPCMAudio, FFmpegOpusAudio, Member
+from yt_dlp import YoutubeDL, DownloadError
 
+from config.settings import SETTINGS
 from lib.contexts import CustomApplicationContext
+from lib.db.database import Database
+from lib.db.db_classes import TrackResolution, StreamUrl
 from lib.exceptions import YouTubeNotEnabled
+from lib.music.executor import ExtractionExecutor
+from lib.music.matching import MatchScorer
+from lib.music.ytdl_pool import YoutubeDLPool
 from lib.spotify.track import Track
-from lib.utils import similarity
 
 
-class YTDLSource(PCMVolumeTransformer):
+# Module-level, so the extraction executor can also run them in worker processes
+
+def _extract_info(url: str) -> dict:
+    with YTDLSource.ytdl_pool.checkout() as ytdl:
+        return ytdl.extract_info(url, download=False)
+
+
+def _top_results(ytdl: YoutubeDL, url: str, limit: int) -> dict | list[dict]:
+    data = ytdl.extract_info(url, download=False, process=False)
+    if 'entries' not in data:
+        return data
+    return list(islice(filter(None, data['entries']), limit))  # entries is a generator, only take what is needed
+
+
+def _search_info(url: str, limit: int) -> dict | list[dict]:
+    with YTDLSource.ytdl_pool.checkout() as ytdl:
+        return _top_results(ytdl, url, limit)
+
+
+def _search_extract(url: str, match: str, limit: int, artist: str | None, duration: int | None) -> dict:
+    """
+    Searches, picks the closest match and extracts it in one job,
+    so a search costs one executor round trip instead of two.
+
+    :raises ValueError: If there are no results.
+    """
+
+    with YTDLSource.ytdl_pool.checkout() as ytdl:
+        data = _top_results(ytdl, url, limit)
+        if isinstance(data, list):
+            data = YTDLSource._get_closest_match(data, match, artist, duration) if data else None
+
+        if not data:
+            raise ValueError("No data to process")
+        return ytdl.process_ie_result(data, download=False)
+
+
+class YTDLSource(AudioSource):
+    """
+    A playable page with its metadata.
+    The audio is either decoded to PCM and scaled in Python or, with OpusPassthrough and an Opus stream,
+    handed to Discord as Opus by ffmpeg. At full volume, the stream is then copied without decoding at all.
+    Other codecs are always decoded to PCM.
+
+    ffmpeg is only started when the first frame is read and stopped on cleanup,
+    so queued, prefetched and past songs do not hold a process.
+    """
+
     YTDL_OPTIONS = {
         'format': 'bestaudio/best',
         'extractaudio': True,
@@ -29,21 +83,45 @@ class YTDLSource(PCMVolumeTransformer):
 
     }
 
+    SEARCH_URL = "https://music.youtube.com/search?q={}#songs"
+    SEARCH_RESULTS = 5  # Results scored against the searched track
+
     FFMPEG_OPTIONS = {
         'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
         'options': '-vn'
     }
 
-    ytdl: YoutubeDL = YoutubeDL(YTDL_OPTIONS)
-
-    def __init__(self, requester: Member, source: FFmpegPCMAudio, *, data: dict, volume: float = 0.5) -> None:
-        super().__init__(source, volume)
-
+    # Metadata keys needed to rebuild a source from the track resolution cache
+    CACHED_KEYS = (
+        'title', 'channel_url', 'uploader_url', 'webpage_url', 'view_count', 'like_count', 'duration', 'uploader',
+        'upload_date', 'thumbnails', 'thumbnail', 'acodec'
+    )
+    RESOLUTION_TTL = SETTINGS['Music']['ResolutionTTL']  # Spotify track -> page, pages rarely change
+    STREAM_URL_TTL = 60 * 60  # Used if the stream URL has no expire parameter
+    STREAM_URL_MARGIN = 5 * 60  # Stream URLs are considered expired this long before they actually expire
+
+    # One instance per worker thread, worker processes import this module and get a pool of their own
+    ytdl_pool: YoutubeDLPool = YoutubeDLPool(
+        YTDL_OPTIONS, 1 if SETTINGS['Music']['ExtractionProcesses'] else SETTINGS['Music']['ExtractionWorkers']
+    )
+    executor: ExtractionExecutor = ExtractionExecutor(
+        SETTINGS['Music']['ExtractionWorkers'],
+        SETTINGS['Music']['ExtractionQueueSize'],
+        SETTINGS['Music']['ExtractionTimeout'],
+        SETTINGS['Music']['ExtractionProcesses']
+    )
+
+    def __init__(self, requester: Member, *, data: dict, volume: float = SETTINGS['Music']['Volume']) -> None:
+        self._original = None  # Started on the first read
+        self._acodec = data.get('acodec')
+        self._opus = SETTINGS['Music']['OpusPassthrough'] and self._acodec == 'opus'  # Fixed, asked before playing
         self._requester = requester
+        self._volume = volume
         self._name = data.get('title')
         self._uploader_url = data.get('channel_url') or data.get('uploader_url')
         self._url = data.get('webpage_url')
         self._stream_url = data.get('url')
+        self._expires_at = self.stream_url_expiry(self._stream_url) if self._stream_url else 0
         self._views = data.get('view_count')
         self._likes = data.get('like_count')
         self._duration = data.get('duration')
@@ -63,6 +141,77 @@ class YTDLSource(PCMVolumeTransformer):
         except (IndexError, TypeError):
             self._thumbnail_url = data.get('thumbnail')  # Let yt-dl decide
 
+    def _create_source(self) -> AudioSource:
+        """
+        Starts streaming the stream URL.
+        :return: The audio source.
+        """
+
+        if not self._opus:
+            return PCMVolumeTransformer(FFmpegPCMAudio(self._stream_url, **self.FFMPEG_OPTIONS), self._volume)
+
+        options: str = self.FFMPEG_OPTIONS['options']
+        if self._volume != 1.0:
+            options += f" -af volume={self._volume}"
+        return FFmpegOpusAudio(
+            self._stream_url,
+            codec='opus' if self.passthrough else None,
+            before_options=self.FFMPEG_OPTIONS['before_options'],
+            options=options
+        )
+
+    def read(self) -> bytes:
+        if self._original is None:
+            self._original = self._create_source()
+        return self._original.read()
+
+    def is_opus(self) -> bool:
+        return self._opus
+
+    def cleanup(self) -> None:
+        """
+        Stops ffmpeg. The next read starts the stream from the beginning again.
+        :return: None
+        """
+
+        original, self._original = self._original, None
+        if original is not None:
+            original.cleanup()
+
+    def reset(self) -> None:
+        """
+        Rewinds the source, so it can be played again.
+        :return: None
+        """
+        self.cleanup()
+
+    @property
+    def original(self) -> AudioSource | None:
+        """
+        :return: The running stream, None if ffmpeg is not running.
+        """
+        return self._original
+
+    @property
+    def passthrough(self) -> bool:
+        """
+        :return: Whether the stream is Opus and copied to Discord without decoding.
+        """
+        return self._opus and self._volume == 1.0
+
+    @property
+    def volume(self) -> float:
+        """
+        :return: The volume. With OpusPassthrough, ffmpeg applies it, so changes take effect on the next reset.
+        """
+        return self._volume
+
+    @volume.setter
+    def volume(self, value: float) -> None:
+        self._volume = max(value, 0.0)
+        if isinstance(self._original, PCMVolumeTransformer):
+            self._original.volume = self._volume
+
     @property
     def requester(self) -> Member:
         return self._requester  # type: ignore
@@ -91,6 +240,20 @@ class YTDLSource(PCMVolumeTransformer):
     def stream_url(self) -> str:
         return self._stream_url
 
+    @property
+    def expires_at(self) -> int:
+        """
+        :return: The UNIX timestamp after which the stream URL should no longer be used.
+        """
+        return self._expires_at
+
+    @property
+    def expired(self) -> bool:
+        """
+        :return: Whether the stream URL expired, playing it would fail.
+        """
+        return time() >= self._expires_at
+
     @property
     def thumbnail_url(self) -> str:
         return self._thumbnail_url
@@ -107,6 +270,22 @@ class YTDLSource(PCMVolumeTransformer):
     def duration(self) -> int | None:
         return self._duration
 
+    @classmethod
+    def stream_url_expiry(cls, stream_url: str) -> int:
+        """
+        Gets the UNIX timestamp after which a stream URL should no longer be used.
+        Parsed from the expire parameter of the URL if present.
+
+        :param stream_url: The stream URL.
+        :return: The UNIX timestamp.
+        """
+
+        try:
+            expire: int = int(parse_qs(urlparse(stream_url).query)['expire'][0])
+        except (KeyError, IndexError, ValueError):
+            expire: int = int(time()) + cls.STREAM_URL_TTL
+        return expire - cls.STREAM_URL_MARGIN
+
     def __str__(self) -> str:
         return f"{self.name} by {self.artist}"
 
@@ -123,11 +302,19 @@ class YTDLSource(PCMVolumeTransformer):
         :param loop: The event loop to run the processing in.
         :return: The processed data.
         """
-        processed_data = await loop.run_in_executor(
-            None,
-            lambda: cls.ytdl.extract_info(data['url'], download=False)
-        )
-        return cls(requester, FFmpegPCMAudio(processed_data['url'], **cls.FFMPEG_OPTIONS), data=processed_data)
+        processed_data = await cls._extract(data['url'], requester.guild.id)
+        return cls(requester, data=processed_data)
+
+    @classmethod
+    async def _extract(cls, url: str, guild_id: int) -> dict:
+        """
+        Fully extracts a page, including the stream URL.
+
+        :param url: The URL of the page.
+        :param guild_id: The ID of the guild the extraction is for.
+        :return: The extracted data.
+        """
+        return await cls.executor.run(guild_id, _extract_info, url)
 
     @classmethod
     async def from_url(cls, ctx: CustomApplicationContext, url: str, loop: AbstractEventLoop) -> Self:
@@ -140,7 +327,7 @@ class YTDLSource(PCMVolumeTransformer):
         :param loop: The event loop to run the YTDLSource creation in.
         :return: The created YTDLSource.
         """
-        data = await loop.run_in_executor(None, lambda: cls.ytdl.extract_info(url, download=False))
+        data = await cls._extract(url, ctx.guild.id)
 
         # Check whether the URL is from YouTube
         if data['webpage_url_domain'] == 'youtube.com' and not ctx.bot.settings['Music']['YouTubeEnabled']:
@@ -148,46 +335,37 @@ class YTDLSource(PCMVolumeTransformer):
 
         if 'entries' in data:
             data = data['entries'][0]
-        return cls(ctx.author, FFmpegPCMAudio(data['url'], **cls.FFMPEG_OPTIONS), data=data)
+        return cls(ctx.author, data=data)
 
     @classmethod
-    async def _get_top_results(cls, search: str, loop: AbstractEventLoop) -> dict | list[dict]:
+    async def _get_top_results(cls, search: str, guild_id: int) -> dict | list[dict]:
         """
         Searches for a track on YouTube.
 
         :param search: The search to perform.
-        :param loop: The event loop to run the search in.
+        :param guild_id: The ID of the guild the search is for.
         :return: The search results.
         """
 
-        data = await loop.run_in_executor(None, lambda: cls.ytdl.extract_info(
-            f"https://music.youtube.com/search?q={quote(search)}#songs",
-            download=False,
-            process=False
-        ))
-
-        process_info: dict | list[dict] = []
-        if 'entries' not in data:
-            process_info = data
-        else:
-            for entry in data['entries']:  # entries is a generator, so we need to iterate through it
-                if entry:
-                    process_info.append(entry)
-
-                if len(process_info) == 3:
-                    break
-        return process_info
+        return await cls.executor.run(guild_id, _search_info, cls.SEARCH_URL.format(quote(search)), cls.SEARCH_RESULTS)
 
     @staticmethod
-    def _get_closest_match(results: list[dict], match: str) -> dict:
+    def _get_closest_match(
+            results: list[dict],
+            match: str,
+            artist: str | None = None,
+            duration: int | None = None
+    ) -> dict:
         """
         Gets the closest match from a list of results.
 
         :param results: The results to search through.
-        :param match: The match to find.
+        :param match: The title to find.
+        :param artist: The artist of the track, matched against the channel and title.
+        :param duration: The duration of the track in seconds.
         :return: The closest match.
         """
-        return max(results, key=lambda x: similarity(x['title'], match))
+        return MatchScorer(match, artist, duration).best(results)
 
     @classmethod
     async def from_search(cls, requester: Member, search: str, loop: AbstractEventLoop) -> Self:
@@ -200,17 +378,86 @@ class YTDLSource(PCMVolumeTransformer):
         :return: The created YTDLSource.
         """
 
-        process_info = await cls._get_top_results(search, loop)
+        data: dict = await cls._search_extract(search, search, requester.guild.id)
+        return cls(requester, data=data)
+
+    @classmethod
+    async def _search_best(
+            cls,
+            search: str,
+            match: str,
+            guild_id: int,
+            artist: str | None = None,
+            duration: int | None = None
+    ) -> dict:
+        """
+        Searches for a track and returns the unprocessed data of the closest match.
+
+        :param search: The search to perform.
+        :param match: The title to match the results against.
+        :param guild_id: The ID of the guild the search is for.
+        :param artist: The artist of the track.
+        :param duration: The duration of the track in seconds.
+        :return: The unprocessed data of the closest match.
+
+        :raises ValueError: If there are no results.
+        """
+
+        process_info = await cls._get_top_results(search, guild_id)
 
         if isinstance(process_info, list):
-            process_info = cls._get_closest_match(process_info, search)
+            process_info = cls._get_closest_match(process_info, match, artist, duration)
 
         if not process_info:
             raise ValueError("No data to process")
-        return await cls.process_result(requester, process_info, loop)
+        return process_info
 
     @classmethod
-    async def from_advanced_search(cls, requester: Member, name: str, artist: str, loop: AbstractEventLoop) -> Self:
+    async def _search_extract(
+            cls,
+            search: str,
+            match: str,
+            guild_id: int,
+            artist: str | None = None,
+            duration: int | None = None
+    ) -> dict:
+        """
+        Searches for a track and fully extracts the closest match.
+        With SinglePassSearch enabled, both steps run in a single extraction job.
+
+        :param search: The search to perform.
+        :param match: The title to match the results against.
+        :param guild_id: The ID of the guild the search is for.
+        :param artist: The artist of the track.
+        :param duration: The duration of the track in seconds.
+        :return: The extracted data of the closest match.
+
+        :raises ValueError: If there are no results.
+        """
+
+        if SETTINGS['Music']['SinglePassSearch']:
+            return await cls.executor.run(
+                guild_id,
+                _search_extract,
+                cls.SEARCH_URL.format(quote(search)),
+                match,
+                cls.SEARCH_RESULTS,
+                artist,
+                duration
+            )
+
+        process_info = await cls._search_best(search, match, guild_id, artist, duration)
+        return await cls._extract(process_info['url'], guild_id)
+
+    @classmethod
+    async def from_advanced_search(
+            cls,
+            requester: Member,
+            name: str,
+            artist: str,
+            loop: AbstractEventLoop,
+            duration: int | None = None
+    ) -> Self:
         """
         Creates a YTDLSource from an advanced search.
 
@@ -218,29 +465,82 @@ class YTDLSource(PCMVolumeTransformer):
         :param name: The name of the track.
         :param artist: The artist of the track.
         :param loop: The event loop to run the YTDLSource creation in.
+        :param duration: The duration of the track in seconds, results far off are ranked lower.
         :return: The created YTDLSource.
         """
 
-        search = f"{name} {artist}"
-        process_info = await cls._get_top_results(search, loop)
-
-        if isinstance(process_info, list):
-            process_info = cls._get_closest_match(process_info, name)
-
-        if not process_info:
-            raise ValueError("No data to process")
-        return await cls.process_result(requester, process_info, loop)
+        data: dict = await cls._search_extract(f"{name} {artist}", name, requester.guild.id, artist, duration)
+        return cls(requester, data=data)
 
     @classmethod
-    async def from_track(cls, requester: Member, track: Track, loop: AbstractEventLoop) -> Self:
+    async def from_track(
+            cls,
+            requester: Member,
+            track: Track,
+            loop: AbstractEventLoop,
+            database: Database | None = None
+    ) -> Self:
         """
         Creates a YTDLSource from a Track, currently only supports Spotify tracks.
 
         :param requester: The member who requested the source.
         :param track: The track to create the source from.
         :param loop: The event loop to run the YTDLSource creation in.
+        :param database: The database to cache the resolution in.
         :return: The created YTDLSource.
         """
 
         artists: str = ' '.join(str(artist) for artist in track.artists)
-        return await cls.from_advanced_search(requester, track.name, artists, loop)
+        return await cls.from_spotify(requester, track.id, track.name, artists, track.duration, loop, database)
+
+    @classmethod
+    async def from_spotify(
+            cls,
+            requester: Member,
+            spotify_id: str,
+            name: str,
+            artists: str,
+            duration: int,
+            loop: AbstractEventLoop,
+            database: Database | None = None,
+            min_lifetime: int = 0
+    ) -> Self:
+        """
+        Creates a YTDLSource from the details of a Spotify track.
+        If a database is given, resolutions and stream URLs are cached in it,
+        so popular tracks skip the search and, while the stream URL is valid, the extraction.
+
+        :param requester: The member who requested the source.
+        :param spotify_id: The Spotify ID of the track.
+        :param name: The name of the track.
+        :param artists: The artists of the track.
+        :param duration: The duration of the track in seconds.
+        :param loop: The event loop to run the YTDLSource creation in.
+        :param database: The database to cache the resolution in.
+        :param min_lifetime: How many seconds a cached stream URL has to stay valid at least to be reused.
+        :return: The created YTDLSource.
+        """
+
+        if database is None:
+            return await cls.from_advanced_search(requester, name, artists, loop, duration)
+
+        data: dict | None = None
+        if resolution := await database.get_track_resolution(spotify_id, cls.RESOLUTION_TTL):
+            if stream_url := await database.get_stream_url(resolution.url, min_lifetime):
+                return cls(requester, data=resolution.data | {'url': stream_url.stream_url})
+            try:
+                data = await cls._extract(resolution.url, requester.guild.id)
+            except DownloadError:  # The page was removed, made private or is blocked, search again
+                await database.remove_track_resolution(spotify_id)
+
+        if data is None:
+            data = await cls._search_extract(f"{name} {artists}", name, requester.guild.id, artists, duration)
+
+        await database.set_track_resolution(TrackResolution(
+            spotify_id,
+            data['webpage_url'],
+            {key: data.get(key) for key in cls.CACHED_KEYS},
+            int(time())
+        ))
+        await database.set_stream_url(StreamUrl(data['webpage_url'], data['url'], cls.stream_url_expiry(data['url'])))
+        return cls(requester, data=data)
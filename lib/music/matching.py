@@ -0,0 +1,124 @@
+from re import findall
+
+from numpy import array, ndarray, abs as np_abs, where, isnan, float64, zeros, repeat, arange, fromiter, intp
+
+
+def tokenize(text: str | None) -> list[str]:
+    """Splits a text into lowercase word tokens, punctuation is dropped."""
+    return findall(r"\w+", text.lower()) if text else []
+
+
+class MatchScorer:
+    """
+    Scores search results against the track that was searched for.
+    Combines title similarity, whether the artist appears in the channel or title,
+    and how far the duration is off. The query is tokenized once, a batch of results is scored at once.
+    """
+
+    TITLE_WEIGHT = 0.5
+    ARTIST_WEIGHT = 0.25
+    DURATION_WEIGHT = 0.25
+    DURATION_TOLERANCE = 20  # Seconds off at which the duration score halves
+
+    # Versions that are rarely wanted unless asked for, e.g. live recordings or hour-long loops
+    PENALIZED_TOKENS = frozenset((
+        'live', 'loop', 'hour', 'hours', 'cover', 'karaoke', 'remix', 'sped', 'slowed', 'reverb', 'nightcore',
+        'instrumental', 'reaction'
+    ))
+    PENALTY = 0.75  # Factor per penalized token
+
+    def __init__(self, title: str, artist: str | None = None, duration: int | None = None) -> None:
+        self._title_tokens = list(dict.fromkeys(tokenize(title)))
+        self._artist_tokens = list(dict.fromkeys(tokenize(artist)))
+        self._duration = duration
+
+        query_tokens: set[str] = set(self._title_tokens) | set(self._artist_tokens)
+        penalized: list[str] = [token for token in self.PENALIZED_TOKENS if token not in query_tokens]
+
+        # Every token the results are checked for gets a column, each signal reads its own columns
+        tokens: dict[str, None] = dict.fromkeys(self._title_tokens + self._artist_tokens + penalized)
+        self._columns: dict[str, int] = {token: column for column, token in enumerate(tokens)}
+        self._title_columns = array([self._columns[token] for token in self._title_tokens], dtype=intp)
+        self._artist_columns = array([self._columns[token] for token in self._artist_tokens], dtype=intp)
+        self._penalized_columns = array([self._columns[token] for token in penalized], dtype=intp)
+
+    def _contains(self, tokens: list[list[str]]) -> ndarray:
+        """
+        Looks up each token once and scatters the hits into the matrix in one step,
+        instead of checking every result for every column.
+
+        :param tokens: The tokens of each result.
+        :return: A matrix of whether each result (rows) contains each column token (columns).
+        """
+
+        lengths: list[int] = [len(candidate) for candidate in tokens]
+        columns: ndarray = fromiter(
+            (self._columns.get(token, -1) for candidate in tokens for token in candidate),
+            dtype=intp, count=sum(lengths)
+        )
+        rows: ndarray = repeat(arange(len(tokens)), lengths)
+        found: ndarray = columns >= 0
+
+        matrix: ndarray = zeros((len(tokens), len(self._columns)), dtype=bool)
+        matrix[rows[found], columns[found]] = True
+        return matrix
+
+    def score(self, results: list[dict]) -> ndarray:
+        """
+        Scores search results.
+
+        :param results: The search results, as returned by yt-dlp.
+        :return: The score of each result between 0 and 1, higher is better.
+        """
+
+        titles: list[list[str]] = [tokenize(result.get('title')) for result in results]
+        in_title: ndarray = self._contains(titles)
+
+        weights: float = self.TITLE_WEIGHT
+        scores: ndarray = self.TITLE_WEIGHT * self._title_score(titles, in_title)
+
+        if self._artist_tokens:
+            channels: list[list[str]] = [
+                tokenize(result.get('channel') or result.get('uploader')) for result in results
+            ]
+            in_channel: ndarray = self._contains(channels) | in_title
+            weights += self.ARTIST_WEIGHT
+            scores += self.ARTIST_WEIGHT * in_channel[:, self._artist_columns].mean(axis=1)
+
+        if self._duration:
+            weights += self.DURATION_WEIGHT
+            scores += self.DURATION_WEIGHT * self._duration_score(results)
+
+        penalties: ndarray = in_title[:, self._penalized_columns].sum(axis=1)
+        return scores / weights * self.PENALTY ** penalties
+
+    def _title_score(self, titles: list[list[str]], in_title: ndarray) -> ndarray:
+        """
+        :return: The F1 score of the title tokens of each result against the searched title tokens.
+        """
+
+        if not self._title_tokens:
+            return array([0.0] * len(titles))
+
+        matched: ndarray = in_title[:, self._title_columns].sum(axis=1)
+        recall: ndarray = matched / len(self._title_tokens)
+        precision: ndarray = matched / array([max(len(title), 1) for title in titles])
+        total: ndarray = precision + recall
+        return where(total > 0, 2 * precision * recall / where(total > 0, total, 1), 0.0)
+
+    def _duration_score(self, results: list[dict]) -> ndarray:
+        """
+        :return: 1 for an exact duration, 0.5 at DURATION_TOLERANCE seconds off, falling towards 0.
+        Results without a duration score 0.5.
+        """
+
+        durations: ndarray = array([result.get('duration') or float('nan') for result in results], dtype=float64)
+        off: ndarray = np_abs(durations - self._duration) / self.DURATION_TOLERANCE
+        return where(isnan(off), 0.5, 1 / (1 + off ** 2))
+
+    def best(self, results: list[dict]) -> dict:
+        """
+        :param results: The search results, must not be empty.
+        :return: The best scoring result, the first one on ties.
+        """
+        return results[int(self.score(results).argmax())]
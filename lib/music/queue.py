@@ -1,26 +1,195 @@
-from asyncio import Queue
-from collections import deque
-from itertools import islice
+from asyncio import Queue, QueueFull
+from collections import Counter
+from itertools import chain, islice
 from random import shuffle
+from typing import Iterable, Iterator
 
 from lib.music.song import Song
 
 
+class _IndexedList:
+    """
+    A list split into chunks, with a Fenwick tree over the chunk sizes.
+    Finding a position takes O(log n), inserting and deleting there O(log n + CHUNK_SIZE),
+    instead of the O(n) of a deque.
+    """
+
+    CHUNK_SIZE = 256  # Chunks are split once they grow to twice this size
+
+    _chunks: list[list[Song]]
+    _tree: list[int]
+
+    def __init__(self, items: Iterable[Song] = ()) -> None:
+        self._build(list(items))
+
+    def _build(self, items: list[Song]) -> None:
+        self._chunks = [items[i:i + self.CHUNK_SIZE] for i in range(0, len(items), self.CHUNK_SIZE)]
+        self._len = len(items)
+        self._rebuild_tree()
+
+    def _rebuild_tree(self) -> None:
+        """Rebuilds the Fenwick tree in O(number of chunks), needed after chunks were added or removed."""
+        size: int = len(self._chunks)
+        self._tree = [0] * (size + 1)
+        for i, chunk in enumerate(self._chunks, start=1):
+            self._tree[i] += len(chunk)
+            if (parent := i + (i & -i)) <= size:
+                self._tree[parent] += self._tree[i]
+
+    def _update(self, chunk: int, delta: int) -> None:
+        i: int = chunk + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _locate(self, index: int) -> tuple[int, int]:
+        """
+        :param index: A valid, non-negative index.
+        :return: The chunk of the index and the offset in the chunk.
+        """
+
+        chunk: int = 0
+        step: int = 1 << (len(self._chunks).bit_length() - 1) if self._chunks else 0
+        while step:
+            if chunk + step < len(self._tree) and self._tree[chunk + step] <= index:
+                chunk += step
+                index -= self._tree[chunk]
+            step >>= 1
+        return chunk, index
+
+    def _normalize(self, index: int) -> int:
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("queue index out of range")
+        return index
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[Song]:
+        return chain.from_iterable(self._chunks)
+
+    def __getitem__(self, index: int) -> Song:
+        chunk, offset = self._locate(self._normalize(index))
+        return self._chunks[chunk][offset]
+
+    def __setitem__(self, index: int, item: Song) -> None:
+        chunk, offset = self._locate(self._normalize(index))
+        self._chunks[chunk][offset] = item
+
+    def slice(self, start: int | None, stop: int | None, step: int | None = None) -> list[Song]:
+        start, stop, step = slice(start, stop, step).indices(self._len)
+        if step != 1:
+            return list(self)[start:stop:step]
+        if start >= stop:
+            return []
+
+        chunk, offset = self._locate(start)
+        items: Iterator[Song] = chain(self._chunks[chunk][offset:], chain.from_iterable(self._chunks[chunk + 1:]))
+        return list(islice(items, stop - start))
+
+    def insert(self, index: int, item: Song) -> None:
+        index = min(max(index + self._len if index < 0 else index, 0), self._len)
+        if not self._chunks:
+            self._build([item])
+            return
+
+        if index == self._len:
+            chunk, offset = len(self._chunks) - 1, len(self._chunks[-1])
+        else:
+            chunk, offset = self._locate(index)
+
+        self._chunks[chunk].insert(offset, item)
+        self._len += 1
+        if len(self._chunks[chunk]) >= 2 * self.CHUNK_SIZE:
+            items: list[Song] = self._chunks[chunk]
+            self._chunks[chunk:chunk + 1] = [items[:self.CHUNK_SIZE], items[self.CHUNK_SIZE:]]
+            self._rebuild_tree()
+        else:
+            self._update(chunk, 1)
+
+    def append(self, item: Song) -> None:
+        self.insert(self._len, item)
+
+    def extend(self, items: Iterable[Song]) -> None:
+        self._build(list(chain(self, items)))
+
+    def pop(self, index: int = -1) -> Song:
+        chunk, offset = self._locate(self._normalize(index))
+        item: Song = self._chunks[chunk].pop(offset)
+        self._len -= 1
+        if not self._chunks[chunk]:
+            del self._chunks[chunk]
+            self._rebuild_tree()
+        else:
+            self._update(chunk, -1)
+        return item
+
+    def popleft(self) -> Song:
+        return self.pop(0)
+
+    def reverse(self) -> None:
+        self._chunks.reverse()
+        for chunk in self._chunks:
+            chunk.reverse()
+        self._rebuild_tree()
+
+    def replace(self, items: list[Song]) -> None:
+        self._build(items)
+
+    def clear(self) -> None:
+        self._build([])
+
+
 class SongQueue(Queue):
-    _queue: deque
+    """
+    The queue of an audio player.
+    Keeps the total duration and the number of songs per requester up to date,
+    so neither needs a pass over the queue. A song object may only be queued once at a time.
+    """
+
+    _queue: _IndexedList
 
     def __init__(self, maxsize: int = 0) -> None:
         super().__init__(maxsize)
+        self._duration = 0
+        self._durations: dict[int, int] = {}  # id(song): duration the song was counted with
+        self._requesters: Counter[int] = Counter()
 
     def __repr__(self) -> str:
         return f"<SongQueue maxsize={self.maxsize} qsize={self.qsize()}>"
 
-    def __getitem__(self, item: int) -> Song | list[Song]:
+    # Storage hooks of asyncio.Queue
+    def _init(self, maxsize: int) -> None:
+        self._queue = _IndexedList()
+
+    def _put(self, item: Song) -> None:
+        self._queue.append(item)
+        self._added(item)
+
+    def _get(self) -> Song:
+        item: Song = self._queue.popleft()
+        self._removed(item)
+        return item
+
+    def _added(self, song: Song) -> None:
+        self._durations[id(song)] = song.duration or 0
+        self._duration += self._durations[id(song)]
+        self._requesters[song.requester.id] += 1
+
+    def _removed(self, song: Song) -> None:
+        self._duration -= self._durations.pop(id(song), 0)
+        self._requesters[song.requester.id] -= 1
+        if not self._requesters[song.requester.id]:
+            del self._requesters[song.requester.id]
+
+    def __getitem__(self, item: int | slice) -> Song | list[Song]:
         if isinstance(item, slice):
-            return list(islice(self._queue, item.start, item.stop, item.step))
+            return self._queue.slice(item.start, item.stop, item.step)
         return self._queue[item]
 
-    def __iter__(self) -> iter:
+    def __iter__(self) -> Iterator[Song]:
         return iter(self._queue)
 
     def __len__(self) -> int:
@@ -29,24 +198,140 @@ class SongQueue(Queue):
     def __reversed__(self) -> None:
         self._queue.reverse()
 
-    def __setitem__(self, key, value) -> None:
+    def __setitem__(self, key: int, value: Song) -> None:
+        self._removed(self._queue[key])
         self._queue[key] = value
+        self._added(value)
 
-    def __delitem__(self, key) -> None:
-        del self._queue[key]
+    def __delitem__(self, key: int | slice) -> None:
+        if isinstance(key, slice):
+            self.remove_range(key.start, key.stop)
+            return
+        self._removed(self._queue.pop(key))
 
     def __contains__(self, item) -> bool:
         return item in self._queue
 
     def shuffle(self) -> None:
-        shuffle(self._queue)
+        items: list[Song] = list(self._queue)
+        shuffle(items)
+        self._queue.replace(items)
 
     def clear(self) -> None:
         self._queue.clear()
+        self._duration = 0
+        self._durations.clear()
+        self._requesters.clear()
 
     def insert(self, index: int, item: Song) -> None:
+        """
+        Inserts a song at a position, like put_nowait but not necessarily at the end.
+
+        :param index: The position to insert the song at.
+        :param item: The song.
+        :return: None
+
+        :raises asyncio.QueueFull: If the queue is full.
+        """
+
+        if self.full():
+            raise QueueFull()
+
         self._queue.insert(index, item)
+        self._added(item)
+        self._unfinished_tasks += 1
+        self._finished.clear()
+        self._wakeup_next(self._getters)
+
+    def extend(self, songs: list[Song]) -> None:
+        """
+        Appends several songs at once.
+
+        :param songs: The songs to append.
+        :return: None
+
+        :raises asyncio.QueueFull: If not all songs fit into the queue, nothing is added then.
+        """
+
+        if self.maxsize > 0 and len(self) + len(songs) > self.maxsize:
+            raise QueueFull()
+
+        self._queue.extend(songs)
+        for song in songs:
+            self._added(song)
+            self._unfinished_tasks += 1
+            self._wakeup_next(self._getters)
+        self._finished.clear()
+
+    def remove_range(self, start: int | None, stop: int | None) -> list[Song]:
+        """
+        Removes a range of songs.
+
+        :param start: The index of the first song to remove.
+        :param stop: The index after the last song to remove.
+        :return: The removed songs.
+        """
+
+        start, stop, _ = slice(start, stop).indices(len(self))
+        items: list[Song] = list(self._queue)
+        removed: list[Song] = items[start:stop]
+        del items[start:stop]
+        self._queue.replace(items)
+        for song in removed:
+            self._removed(song)
+        return removed
+
+    def move(self, index: int, destination: int) -> None:
+        """
+        Moves a song to another position.
+
+        :param index: The current index of the song.
+        :param destination: The new index of the song.
+        :return: None
+
+        :raises IndexError: If the index is out of range.
+        """
+        self._queue.insert(destination, self._queue.pop(index))
+
+    def dedupe(self) -> int:
+        """
+        Removes songs that are already queued further ahead.
+
+        :return: The number of removed songs.
+        """
+
+        seen: set[str] = set()
+        items: list[Song] = []
+        for song in self._queue:
+            if song.url in seen:
+                self._removed(song)
+                continue
+            seen.add(song.url)
+            items.append(song)
+
+        removed: int = len(self._queue) - len(items)
+        self._queue.replace(items)
+        return removed
+
+    def refresh(self, song: Song) -> None:
+        """
+        Updates the total duration after the source of a queued song changed, e.g. once it was resolved.
+
+        :param song: The song.
+        :return: None
+        """
+
+        if (duration := self._durations.get(id(song))) is not None:
+            self._durations[id(song)] = song.duration or 0
+            self._duration += self._durations[id(song)] - duration
+
+    def count(self, requester_id: int) -> int:
+        """
+        :param requester_id: The ID of a member.
+        :return: The number of queued songs the member requested.
+        """
+        return self._requesters[requester_id]
 
     @property
     def duration(self) -> int:
-        return sum(song.duration for song in self._queue)
+        return self._duration
@@ -0,0 +1,138 @@
+from asyncio import TimerHandle, get_running_loop
+from heapq import heappush, heappop, heapify
+from itertools import count
+from typing import Callable, Hashable
+
+from lib.logging import log, save_traceback
+
+
+class IdleScheduler:
+    """
+    Keeps the idle deadlines of all audio players in one heap, with a single timer armed for the earliest one.
+    Deadlines are moved on events instead of being polled, an idle player costs a heap entry and no task.
+    Moving or cancelling a deadline leaves its old heap entry behind, it is skipped once it comes up.
+    """
+
+    COMPACT_THRESHOLD = 64  # Outdated heap entries tolerated before the heap is rebuilt
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, int, Hashable]] = []  # deadline, sequence number, key
+        self._deadlines: dict[Hashable, tuple[float, int, Callable[[], None]]] = {}  # key: deadline, sequence, callback
+        self._sequence = count()
+        self._timer: TimerHandle | None = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._deadlines
+
+    def deadline(self, key: Hashable) -> float | None:
+        """
+        :param key: The key of the deadline.
+        :return: The deadline in event loop time, None if none is scheduled.
+        """
+
+        entry: tuple[float, int, Callable[[], None]] | None = self._deadlines.get(key)
+        return entry[0] if entry else None
+
+    def schedule(self, key: Hashable, deadline: float, callback: Callable[[], None]) -> None:
+        """
+        Sets a deadline, replacing the previous one of the key.
+
+        :param key: The key of the deadline, e.g. a player.
+        :param deadline: When to call the callback, in event loop time, see `asyncio.AbstractEventLoop.time`.
+        :param callback: The function to call once the deadline passed.
+        :return: None
+        """
+
+        entry: tuple[float, int, Callable[[], None]] | None = self._deadlines.get(key)
+        if entry and entry[0] == deadline and entry[2] == callback:
+            return
+
+        sequence: int = next(self._sequence)
+        self._deadlines[key] = (deadline, sequence, callback)
+        heappush(self._heap, (deadline, sequence, key))
+        self._compact()
+        self._arm()
+
+    def cancel(self, key: Hashable) -> None:
+        """
+        Removes the deadline of a key, if there is one.
+
+        :param key: The key of the deadline.
+        :return: None
+        """
+
+        if self._deadlines.pop(key, None) is not None:
+            self._compact()
+            self._arm()
+
+    def close(self) -> None:
+        """
+        Removes all deadlines without calling their callbacks.
+        :return: None
+        """
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._heap.clear()
+        self._deadlines.clear()
+
+    def _outdated(self, item: tuple[float, int, Hashable]) -> bool:
+        entry: tuple[float, int, Callable[[], None]] | None = self._deadlines.get(item[2])
+        return entry is None or entry[1] != item[1]
+
+    def _compact(self) -> None:
+        """
+        Rebuilds the heap from the current deadlines once too many outdated entries piled up.
+        :return: None
+        """
+
+        if len(self._heap) > 2 * len(self._deadlines) + self.COMPACT_THRESHOLD:
+            self._heap = [(deadline, sequence, key) for key, (deadline, sequence, _) in self._deadlines.items()]
+            heapify(self._heap)
+
+    def _arm(self) -> None:
+        """
+        Points the timer at the earliest deadline.
+        :return: None
+        """
+
+        while self._heap and self._outdated(self._heap[0]):
+            heappop(self._heap)
+
+        if not self._heap:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            return
+
+        deadline: float = self._heap[0][0]
+        if self._timer is not None:
+            if self._timer.when() == deadline:
+                return
+            self._timer.cancel()
+        self._timer = get_running_loop().call_at(deadline, self._fire)
+
+    def _fire(self) -> None:
+        """
+        Calls the callbacks of all passed deadlines.
+        :return: None
+        """
+
+        self._timer = None
+        now: float = get_running_loop().time()
+        while self._heap and self._heap[0][0] <= now:
+            item: tuple[float, int, Hashable] = heappop(self._heap)
+            if self._outdated(item):
+                continue
+
+            _, _, callback = self._deadlines.pop(item[2])
+            try:
+                callback()
+            except Exception as e:
+                log(f"Idle callback error: {e}", error=True)
+                get_running_loop().create_task(save_traceback(e))
+        self._arm()
@@ -0,0 +1,30 @@
+from dataclasses import dataclass
+from urllib.parse import quote
+
+from lib.music.extraction import YTDLSource
+
+
+@dataclass(frozen=True)
+class SearchQuery:
+    """
+    A text search, queued as is and searched for once the song is about to be played.
+
+    :ivar query: The text to search for.
+    """
+
+    query: str
+
+    @property
+    def name(self) -> str:
+        return self.query
+
+    @property
+    def url(self) -> str:
+        return YTDLSource.SEARCH_URL.format(quote(self.query))
+
+    @property
+    def duration(self) -> int:
+        """
+        :return: 0, the duration is unknown until the search ran.
+        """
+        return 0
@@ -1,44 +1,73 @@
+from asyncio import AbstractEventLoop
+from copy import copy
 from typing import Self
 from urllib.parse import urlparse
 
 from discord import Member, Embed
 
+from lib.db.database import Database
 from lib.enums import SongEmbedSize, AudioPlayerLoopMode
 from lib.music.extraction import YTDLSource
+from lib.music.search_query import SearchQuery
 from lib.spotify.track import Track
 from lib.utils import format_time, shortened, truncate
 
 
 class Song:
     """
-    Class to represent a song
+    Class to represent a song.
+    A queued song is a compact entry of what the queue shows and what is needed to find it again.
+    The playable source is only held while the song is played or prefetched.
     """
 
-    def __init__(self, source: YTDLSource | Track, requester: Member = None) -> None:
-        if isinstance(source, Track):
+    __slots__ = ('_source', '_requester', '_spotify_id', '_url', '_title', '_artist', '_duration')
+
+    SPOTIFY_TRACK_URL = "https://open.spotify.com/track/{}"
+
+    def __init__(self, source: YTDLSource | Track | SearchQuery, requester: Member = None) -> None:
+        if isinstance(source, (Track, SearchQuery)):
             if not requester:
-                raise ValueError("Requester must be provided when creating a Song from a Track")
+                raise ValueError("Requester must be provided when creating a Song from a Track or SearchQuery")
 
-        self._source = source
+        # Members are shared by all songs of a request, only a reference is kept
         self._requester = requester or source.requester
+        self._source = None
+        self._spotify_id = None
+        self._url = None
+        self._title = source.name
+        self._artist = None
+        self._duration = source.duration or 0
+
+        if isinstance(source, Track):
+            self._spotify_id = source.id
+            self._artist = ', '.join(str(artist) for artist in source.artists)
+        elif isinstance(source, YTDLSource):
+            self.source = source
 
     @property
-    def source(self) -> YTDLSource | Track:
+    def source(self) -> YTDLSource | None:
         """
         It is recommended to use the properties of this class instead of this property
-        :return: The source of the song.
+        :return: The playable source of the song, None while it is not resolved.
         """
         return self._source
 
     @source.setter
-    def source(self, source: YTDLSource | Track) -> None:
+    def source(self, source: YTDLSource) -> None:
         """
         Can be used to change the source of the song.
+        Songs without a Spotify track are found again by the URL of the source once it was released.
 
         :param source: The new source of the song.
         :return: None
         """
+
         self._source = source
+        if self._spotify_id is None:
+            self._url = source.url
+            self._title = source.name
+            self._artist = source.artist
+            self._duration = source.duration or 0
 
     @property
     def requester(self) -> Member:
@@ -52,30 +81,86 @@ class Song:
         """
         :return: The title of the song.
         """
-        return self.source.name
+        return self._source.name if self._source else self._title
 
     @property
     def artist(self) -> str:
         """
         :return: The artist of the song.
         """
-        if isinstance(self.source, YTDLSource):
-            return self.source.artist
-        return self.source.artists[0].name
+        if self._source:
+            return self._source.artist
+        return self._artist or "Unknown Artist"
 
     @property
     def url(self) -> str:
         """
         :return: The url of the song.
         """
-        return self.source.url
+        if self._source:
+            return self._source.url
+        if self._spotify_id:
+            return self.SPOTIFY_TRACK_URL.format(self._spotify_id)
+        return self._url or SearchQuery(self._title).url
+
+    @property
+    def resolved(self) -> bool:
+        """
+        :return: Whether the song has a playable source.
+        """
+        return self._source is not None
 
     @property
     def duration(self) -> int:
         """
         :return: The duration of the song in seconds.
         """
-        return self.source.duration
+        return (self._source.duration if self._source else self._duration) or 0
+
+    async def materialize(
+            self,
+            loop: AbstractEventLoop,
+            database: Database | None = None,
+            min_lifetime: int = 0
+    ) -> YTDLSource:
+        """
+        Creates a fresh playable source for the song, it is not assigned to the song.
+        Spotify tracks are searched for by their details, text searches by their query,
+        other songs are extracted from their URL again.
+
+        :param loop: The event loop to run the YTDLSource creation in.
+        :param database: The database to cache Spotify track resolutions in.
+        :param min_lifetime: How many seconds a cached stream URL has to stay valid at least to be reused.
+        :return: The created YTDLSource.
+        """
+
+        if self._spotify_id:
+            return await YTDLSource.from_spotify(
+                self._requester, self._spotify_id, self._title, self._artist, self._duration, loop, database,
+                min_lifetime
+            )
+        if self._url is None:
+            return await YTDLSource.from_search(self._requester, self._title, loop)
+        return await YTDLSource.process_result(self._requester, {'url': self._url}, loop)
+
+    def release(self) -> None:
+        """
+        Drops the playable source, only the compact entry is kept until the song is materialized again.
+        :return: None
+        """
+
+        if self._source is not None:
+            self._source.cleanup()
+            self._source = None
+
+    def detached(self) -> Self:
+        """
+        :return: A copy of the song without its playable source, e.g. to queue it again.
+        """
+
+        song: Song = copy(self)
+        song._source = None
+        return song
 
     def get_embed(
             self,
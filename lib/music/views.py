@@ -22,7 +22,7 @@ class QueueFill(View):
 
         if audio_player.full:
             raise QueueFull('Queue is full')
-        free: int = 200 - len(audio_player)
+        free: int = audio_player.free
 
         parts: int = min(tracks.total // free, 22)
         remainder: int = tracks.total % free
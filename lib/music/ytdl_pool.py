@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+from queue import SimpleQueue
+from typing import Any, Iterator
+
+from yt_dlp import YoutubeDL
+
+
+class YoutubeDLPool:
+    """
+    A fixed set of pre-initialized YoutubeDL instances.
+    YoutubeDL keeps per-extraction state on the instance, so concurrent extractions each check out their own.
+    """
+
+    # Extractors used by the bot, initialized up front instead of on the first extraction
+    WARM_EXTRACTORS = ('Youtube', 'YoutubeTab', 'YoutubeMusicSearchURL', 'Generic')
+
+    def __init__(self, options: dict[str, Any], size: int) -> None:
+        self._instances: SimpleQueue[YoutubeDL] = SimpleQueue()
+        self._size = size
+
+        for _ in range(size):
+            ytdl: YoutubeDL = YoutubeDL(options)
+            for ie_key in self.WARM_EXTRACTORS:
+                ytdl.get_info_extractor(ie_key)
+            self._instances.put(ytdl)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @contextmanager
+    def checkout(self) -> Iterator[YoutubeDL]:
+        """
+        Checks out an instance for the duration of one extraction.
+        Blocks if all instances are in use, which does not happen while the pool is sized to the executor.
+
+        :return: The instance.
+        """
+
+        ytdl: YoutubeDL = self._instances.get()
+        try:
+            yield ytdl
+        finally:
+            self._instances.put(ytdl)
@@ -1,13 +1,16 @@
+from asyncio import Semaphore, Task, sleep, get_running_loop, shield, gather
 from datetime import datetime, timedelta
 from re import match
-from time import time
+from time import time, perf_counter
 from typing import AsyncGenerator, Any
 from urllib.parse import quote
 
-from aiohttp import ClientSession, ClientResponse
+from aiohttp import ClientSession, ClientResponse, TCPConnector, ClientTimeout
 
+from lib.db.db_classes import SpotifyCacheEntry
 from lib.spotify.album import Album
 from lib.spotify.artist import Artist
+from lib.spotify.cache import SpotifyCache
 from lib.spotify.data import SpotifyData
 from lib.spotify.exceptions import SpotifyRateLimit, SpotifyNotFound, SpotifyNotAvailable
 from lib.spotify.playlist import Playlist
@@ -19,37 +22,134 @@ class SpotifyAPI:
     A Spotify API client. Lightweight wrapper around the Spotify Web API.
     """
 
+    PAGE_SIZE = 50  # Tracks per page request
+    MAX_CONCURRENT_PAGES = 4  # Page requests in flight per paginated fetch
+    MAX_TRACKS_PER_REQUEST = 50  # Limit of the multiple tracks endpoint
+    MAX_ALBUMS_PER_REQUEST = 20  # Limit of the multiple albums endpoint
+    MAX_RETRY_AFTER = 10  # Longest rate limit in seconds a paginated fetch waits for instead of failing
+    TOKEN_REFRESH_MARGIN = 300  # Seconds before the token expires at which it is renewed in the background
+
+    API_URL = "https://api.spotify.com/v1"
+    TOKEN_URL = "https://accounts.spotify.com/api/token"
+
     _trending_playlists: tuple[dict[str, Any] | None, float]
+    _session: ClientSession | None
+    _token_task: Task[None] | None
 
-    def __init__(self, client_id: str, client_secret: str) -> None:
+    def __init__(self, client_id: str, client_secret: str, cache: SpotifyCache | None = None) -> None:
         self._client_id = client_id
         self._client_secret = client_secret
         self.__token = None
         self._token_expiry = None
+        self._token_task = None
+        self._token_refresh_latency = None
 
         self._retry_after = None
+        self._session = None
+        self._cache = cache
 
         self._trending_playlists = (None, 0.0)
 
+    @property
+    def session(self) -> ClientSession:
+        """
+        The long-lived HTTP session, created on first use.
+        Connections to the Spotify hosts are kept alive and reused across requests.
+        :return: The session.
+        """
+
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=TCPConnector(
+                    limit=100,
+                    limit_per_host=20,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=60
+                ),
+                timeout=ClientTimeout(total=15)
+            )
+        return self._session
+
+    @property
+    def cache(self) -> SpotifyCache | None:
+        """
+        :return: The metadata cache, None if caching is disabled.
+        """
+        return self._cache
+
+    async def start(self) -> None:
+        """
+        Opens the HTTP session, so the first request does not pay for it.
+        :return: None
+        """
+        _ = self.session
+
+    async def close(self) -> None:
+        """
+        Closes the HTTP session and all pooled connections.
+        :return: None
+        """
+
+        if self._token_task is not None:
+            self._token_task.cancel()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
     @property
     def _token(self) -> str | None:
         if self._token_expiry and datetime.now() > self._token_expiry:
             self.__token = None
         return self.__token
 
+    @property
+    def token_refresh_latency(self) -> float | None:
+        """
+        :return: The duration of the last token refresh in seconds, None if the token was never refreshed.
+        """
+        return self._token_refresh_latency
+
+    def _refresh_token(self) -> Task[None]:
+        """
+        Starts a token refresh unless one is already running.
+        All concurrent callers share the same refresh.
+
+        :return: The task of the refresh.
+        """
+
+        if self._token_task is None or self._token_task.done():
+            self._token_task = get_running_loop().create_task(self._get_token())
+            self._token_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._token_task
+
+    async def _ensure_token(self) -> str:
+        """
+        Returns a valid token. Waits for a refresh if there is none,
+        renews it in the background if it is about to expire.
+
+        :return: The token.
+        """
+
+        if not self._token:
+            await shield(self._refresh_token())
+        elif datetime.now() > self._token_expiry - timedelta(seconds=self.TOKEN_REFRESH_MARGIN):
+            self._refresh_token()
+        return self._token
+
     async def _get_token(self) -> None:
-        async with ClientSession() as session:
-            async with session.post(
-                "https://accounts.spotify.com/api/token",
-                data={
-                    "grant_type": "client_credentials",
-                    "client_id": self._client_id,
-                    "client_secret": self._client_secret
-                }
-            ) as response:
-                data = await response.json()
-                self.__token = data["access_token"]
-                self._token_expiry = datetime.now() + timedelta(seconds=data["expires_in"])
+        start: float = perf_counter()
+        async with self.session.post(
+            self.TOKEN_URL,
+            data={
+                "grant_type": "client_credentials",
+                "client_id": self._client_id,
+                "client_secret": self._client_secret
+            }
+        ) as response:
+            data = await response.json()
+            self.__token = data["access_token"]
+            self._token_expiry = datetime.now() + timedelta(seconds=data["expires_in"])
+        self._token_refresh_latency = perf_counter() - start
 
     @staticmethod
     def _strip_url(url: str) -> str:
@@ -63,7 +163,7 @@ class SpotifyAPI:
             case 429:  # Rate limit
                 self._retry_after = datetime.now() + timedelta(seconds=int(response.headers["Retry-After"]))
                 raise SpotifyRateLimit(retry_after=int(response.headers["Retry-After"]))
-            case 200:  # OK
+            case 200 | 304:  # OK, Not modified
                 pass
             case 404:  # No content
                 raise SpotifyNotFound()
@@ -71,22 +171,78 @@ class SpotifyAPI:
                 raise SpotifyNotAvailable(response.reason)
 
     async def _get(self, url: str) -> dict:
-        if not self._token:
-            await self._get_token()
+        return (await self._request(url))[0]
+
+    async def _request(self, url: str, etag: str | None = None) -> tuple[dict | None, str | None]:
+        """
+        :param url: The URL to request.
+        :param etag: The ETag of a cached response, the request is then conditional.
+        :return: The response and its ETag. The response is None if it did not change since the given ETag.
+        """
+
+        token: str = await self._ensure_token()
 
         if self._retry_after and datetime.now() < self._retry_after:
             raise SpotifyRateLimit(retry_after=(self._retry_after - datetime.now()).seconds)
         self._retry_after = None
 
-        async with ClientSession() as session:
-            async with session.get(
-                url,
-                headers={
-                    "Authorization": f"Bearer {self._token}"
-                }
-            ) as response:
-                self._validate_response_status(response)
-                return await response.json()
+        headers: dict[str, str] = {
+            "Authorization": f"Bearer {token}"
+        }
+        if etag:
+            headers["If-None-Match"] = etag
+
+        async with self.session.get(url, headers=headers) as response:
+            self._validate_response_status(response)
+            if response.status == 304:
+                return None, etag
+            return await response.json(), response.headers.get("ETag")
+
+    async def _revalidate(self, url: str, data: dict, etag: str | None) -> tuple[dict | None, str | None]:
+        """
+        Checks whether an expired playlist changed, by ETag or, lacking one, by its snapshot ID.
+
+        :param url: The URL of the playlist.
+        :param data: The cached response.
+        :param etag: The ETag of the cached response.
+        :return: The new response and its ETag. The response is None if the playlist did not change.
+        """
+
+        if etag:
+            return await self._request(url, etag)
+
+        if snapshot_id := data.get("snapshot_id"):
+            if (await self._get(f"{url}?fields=snapshot_id")).get("snapshot_id") == snapshot_id:
+                return None, None
+        return await self._request(url)
+
+    async def _get_cached(self, kind: str, spotify_id: str, url: str) -> dict:
+        """
+        Gets a response from the cache, fetching and caching it if missing or expired.
+        Expired playlists are revalidated instead of fetched again.
+
+        :param kind: The kind of the object, e.g. ``track``.
+        :param spotify_id: The Spotify ID of the object.
+        :param url: The URL of the object.
+        :return: The response.
+        """
+
+        if self._cache is None:
+            return await self._get(url)
+
+        if entry := await self._cache.get(kind, spotify_id):
+            return entry.data
+
+        if kind == "playlist" and (entry := await self._cache.get(kind, spotify_id, stale=True)):
+            data, etag = await self._revalidate(url, entry.data, entry.etag)
+            if data is None:
+                self._cache.touch(entry)
+                return entry.data
+        else:
+            data, etag = await self._request(url)
+
+        self._cache.set(kind, spotify_id, data, etag)
+        return data
 
     async def get_track(self, track_id: str) -> Track:
         """
@@ -103,9 +259,82 @@ class SpotifyAPI:
         if "https://open.spotify.com/" in track_id:
             track_id = self._strip_url(track_id)
 
-        response: dict = await self._get(f"https://api.spotify.com/v1/tracks/{track_id}")
+        response: dict = await self._get_cached("track", track_id, f"{self.API_URL}/tracks/{track_id}")
         return Track(response)
 
+    async def _get_many(self, kind: str, url: str, spotify_ids: list[str], chunk_size: int) -> list[dict | None]:
+        """
+        Gets many objects of one kind. Cached objects are taken from the cache,
+        the rest is requested in chunks from the multiple objects endpoint, concurrently.
+
+        :param kind: The kind of the objects, e.g. ``track``.
+        :param url: The URL of the multiple objects endpoint, without ids.
+        :param spotify_ids: The Spotify IDs or URLs of the objects.
+        :param chunk_size: The maximum number of IDs per request.
+        :return: The responses in the order of the IDs, None for objects that could not be found.
+        """
+
+        spotify_ids = [
+            self._strip_url(spotify_id) if "https://open.spotify.com/" in spotify_id else spotify_id
+            for spotify_id in spotify_ids
+        ]
+
+        unique: list[str] = list(dict.fromkeys(spotify_ids))
+        cached: dict[str, SpotifyCacheEntry] = {}
+        if self._cache is not None:
+            cached = await self._cache.get_many(kind, unique)
+        responses: dict[str, dict | None] = {spotify_id: entry.data for spotify_id, entry in cached.items()}
+        missing: list[str] = [spotify_id for spotify_id in unique if spotify_id not in cached]
+
+        semaphore: Semaphore = Semaphore(self.MAX_CONCURRENT_PAGES)
+        chunks: list[list[str]] = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+        pages: list[dict] = await gather(
+            *(self._get_page(f"{url}?ids={','.join(chunk)}", semaphore) for chunk in chunks)
+        )
+
+        for chunk, page in zip(chunks, pages):
+            for spotify_id, data in zip(chunk, page[f"{kind}s"]):
+                responses[spotify_id] = data
+                if data and self._cache is not None:
+                    self._cache.set(kind, spotify_id, data)
+        return [responses[spotify_id] for spotify_id in spotify_ids]
+
+    async def get_tracks(self, track_ids: list[str]) -> list[Track]:
+        """
+        Gets many tracks with one request per MAX_TRACKS_PER_REQUEST uncached tracks.
+
+        :param track_ids: The Spotify IDs or URLs of the tracks.
+        :return: The tracks in the given order. Tracks that could not be found are left out.
+
+        :raises SpotifyRateLimit: If the rate limit is exceeded.
+        :raises SpotifyNotAvailable: If the Spotify API is not available.
+
+        Note: All raised exceptions are subclasses of :class:`SpotifyException`.
+        """
+
+        responses: list[dict | None] = await self._get_many(
+            "track", f"{self.API_URL}/tracks", track_ids, self.MAX_TRACKS_PER_REQUEST
+        )
+        return [Track(response) for response in responses if response]
+
+    async def get_albums(self, album_ids: list[str]) -> list[Album]:
+        """
+        Gets many albums with one request per MAX_ALBUMS_PER_REQUEST uncached albums.
+
+        :param album_ids: The Spotify IDs or URLs of the albums.
+        :return: The albums in the given order. Albums that could not be found are left out.
+
+        :raises SpotifyRateLimit: If the rate limit is exceeded.
+        :raises SpotifyNotAvailable: If the Spotify API is not available.
+
+        Note: All raised exceptions are subclasses of :class:`SpotifyException`.
+        """
+
+        responses: list[dict | None] = await self._get_many(
+            "album", f"{self.API_URL}/albums", album_ids, self.MAX_ALBUMS_PER_REQUEST
+        )
+        return [Album(response) for response in responses if response]
+
     async def get_album(self, album_id: str) -> Album:
         """
         :param album_id: The Spotify ID of the album.
@@ -121,7 +350,7 @@ class SpotifyAPI:
         if "https://open.spotify.com/" in album_id:
             album_id = self._strip_url(album_id)
 
-        response: dict = await self._get(f"https://api.spotify.com/v1/albums/{album_id}")
+        response: dict = await self._get_cached("album", album_id, f"{self.API_URL}/albums/{album_id}")
         return Album(response)
 
     async def get_artist(self, artist_id: str) -> Artist:
@@ -139,15 +368,73 @@ class SpotifyAPI:
         if "https://open.spotify.com/" in artist_id:
             artist_id = self._strip_url(artist_id)
 
-        response: dict = await self._get(f"https://api.spotify.com/v1/artists/{artist_id}/top-tracks?market=DE")
+        response: dict = await self._get_cached(
+            "artist", artist_id, f"{self.API_URL}/artists/{artist_id}/top-tracks?market=DE"
+        )
         return Artist(response)
 
-    async def get_playlist_tracks(self, playlist_id: str, start: int, end: int) -> list[Track]:
+    async def _get_page(self, url: str, semaphore: Semaphore) -> dict:
         """
+        Gets a page, waiting out short rate limits instead of failing.
+
+        :param url: The URL of the page.
+        :param semaphore: The semaphore bounding the concurrent requests.
+        :return: The page.
+
+        :raises SpotifyRateLimit: If the rate limit lasts longer than MAX_RETRY_AFTER.
+        """
+
+        async with semaphore:
+            while True:
+                try:
+                    return await self._get(url)
+                except SpotifyRateLimit as e:
+                    if e.retry_after > self.MAX_RETRY_AFTER:
+                        raise
+                    await sleep(max(e.retry_after, 1))
+
+    async def _iter_pages(self, url: str, start: int, end: int) -> AsyncGenerator[list[dict], None]:
+        """
+        Fetches the items of a paginated endpoint concurrently and yields them page by page, in order.
+
+        :param url: The URL of the endpoint, without offset and limit.
+        :param start: The start index of the items to retrieve.
+        :param end: The end index of the items to retrieve.
+        :return: The items of each page.
+        """
+
+        semaphore: Semaphore = Semaphore(self.MAX_CONCURRENT_PAGES)
+        tasks: list[Task[dict]] = [
+            get_running_loop().create_task(
+                self._get_page(f"{url}?offset={offset}&limit={min(end - offset, self.PAGE_SIZE)}", semaphore)
+            )
+            for offset in range(start, end, self.PAGE_SIZE)
+        ]
+
+        try:
+            for task in tasks:
+                yield (await task)["items"]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def iter_playlist_tracks(
+            self,
+            playlist_id: str,
+            start: int,
+            end: int,
+            keep_missing: bool = False
+    ) -> AsyncGenerator[list[Track | None], None]:
+        """
+        Streams the tracks of a playlist page by page, in order, as soon as each page arrives.
+        Pages are requested concurrently.
+
         :param playlist_id: The Spotify ID of the playlist.
         :param start: The start index of the tracks to retrieve.
         :param end: The end index of the tracks to retrieve.
-        :return: A list of tracks in the specified range.
+        :param keep_missing: Whether unavailable tracks are yielded as None instead of being left out,
+        so positions in the page match positions in the playlist.
+        :return: The tracks of each page.
 
         :raises SpotifyRateLimit: If the rate limit is exceeded.
         :raises SpotifyNotFound: If the playlist could not be found.
@@ -159,14 +446,50 @@ class SpotifyAPI:
         if "https://open.spotify.com/" in playlist_id:
             playlist_id = self._strip_url(playlist_id)
 
-        tracks: list[Track] = []
-        while start < end:
-            limit = min(end - start, 50)
-            response = await self._get(
-                f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks?offset={start}&limit={limit}")
-            tracks.extend([Track(item["track"]) for item in response["items"]])
-            start += limit
+        async for items in self._iter_pages(f"{self.API_URL}/playlists/{playlist_id}/tracks", start, end):
+            tracks: list[Track | None] = [Track(item["track"]) if item["track"] else None for item in items]
+            yield tracks if keep_missing else [track for track in tracks if track]
+
+    async def iter_album_tracks(self, album_id: str, start: int, end: int) -> AsyncGenerator[list[Track], None]:
+        """
+        Streams the tracks of an album page by page, in order, as soon as each page arrives.
+        Pages are requested concurrently.
 
+        :param album_id: The Spotify ID of the album.
+        :param start: The start index of the tracks to retrieve.
+        :param end: The end index of the tracks to retrieve.
+        :return: The tracks of each page.
+
+        :raises SpotifyRateLimit: If the rate limit is exceeded.
+        :raises SpotifyNotFound: If the album could not be found.
+        :raises SpotifyNotAvailable: If the Spotify API is not available.
+
+        Note: All raised exceptions are subclasses of :class:`SpotifyException`.
+        """
+
+        if "https://open.spotify.com/" in album_id:
+            album_id = self._strip_url(album_id)
+
+        async for items in self._iter_pages(f"{self.API_URL}/albums/{album_id}/tracks", start, end):
+            yield [Track(item) for item in items]
+
+    async def get_playlist_tracks(self, playlist_id: str, start: int, end: int) -> list[Track]:
+        """
+        :param playlist_id: The Spotify ID of the playlist.
+        :param start: The start index of the tracks to retrieve.
+        :param end: The end index of the tracks to retrieve.
+        :return: A list of tracks in the specified range.
+
+        :raises SpotifyRateLimit: If the rate limit is exceeded.
+        :raises SpotifyNotFound: If the playlist could not be found.
+        :raises SpotifyNotAvailable: If the Spotify API is not available.
+
+        Note: All raised exceptions are subclasses of :class:`SpotifyException`.
+        """
+
+        tracks: list[Track] = []
+        async for page in self.iter_playlist_tracks(playlist_id, start, end):
+            tracks.extend(page)
         return tracks
 
     async def get_playlist(self, playlist_id: str) -> Playlist:
@@ -184,7 +507,9 @@ class SpotifyAPI:
         if "https://open.spotify.com/" in playlist_id:
             playlist_id = self._strip_url(playlist_id)
 
-        response: dict = await self._get(f"https://api.spotify.com/v1/playlists/{playlist_id}")
+        response: dict = await self._get_cached(
+            "playlist", playlist_id, f"{self.API_URL}/playlists/{playlist_id}"
+        )
         return Playlist(response)
 
     async def search(self, query: str, limit: int = 10) -> AsyncGenerator[Track, None]:
@@ -200,7 +525,7 @@ class SpotifyAPI:
         Note: All raised exceptions are subclasses of :class:`SpotifyException`.
         """
         query = quote(query)
-        response: dict = await self._get(f"https://api.spotify.com/v1/search?q={query}&type=track&limit={limit}")
+        response: dict = await self._get(f"{self.API_URL}/search?q={query}&type=track&limit={limit}")
         for track in response["tracks"]["items"]:
             yield Track(track)
 
@@ -224,6 +549,6 @@ class SpotifyAPI:
                 pass
 
         if not use_cache:
-            response: dict = await self._get("https://api.spotify.com/v1/browse/featured-playlists")
+            response: dict = await self._get(f"{self.API_URL}/browse/featured-playlists")
             self._trending_playlists = (response["playlists"]["items"], time())
         return [SpotifyData(playlist) for playlist in self._trending_playlists[0]]
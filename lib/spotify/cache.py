@@ -0,0 +1,199 @@
+from asyncio import Task, get_running_loop, sleep
+from collections import OrderedDict
+from time import time
+
+from aiosqlite import Error
+
+from lib.db.database import Database
+from lib.db.db_classes import SpotifyCacheEntry
+from lib.logging import log
+
+
+class SpotifyCache:
+    """
+    A bounded LRU cache of Spotify API responses, keyed by kind and Spotify ID.
+    Responses are stored raw, so every caller builds its own objects and may mutate them freely.
+    Optionally persisted to the database, so the cache survives restarts.
+    Entries set during one iteration of the event loop, e.g. a page of tracks, are written in one transaction.
+    """
+
+    DEFAULT_TTL = {
+        "track": 86400,
+        "album": 86400,
+        "artist": 3600,  # Top tracks change over time
+        "playlist": 600  # Revalidated by ETag or snapshot ID once expired
+    }
+
+    _entries: OrderedDict[str, SpotifyCacheEntry]
+    _pending: dict[str, SpotifyCacheEntry]
+    _flush_task: Task[None] | None
+
+    def __init__(self, max_size: int = 1024, ttl: dict[str, int] | None = None, database: Database | None = None):
+        self._entries = OrderedDict()
+        self._pending = {}  # Entries waiting to be written to the database
+        self._flush_task = None
+        self._max_size = max_size
+        self._ttl = self.DEFAULT_TTL | (ttl or {})
+        self._database = database
+
+        self._hits = 0
+        self._revalidations = 0
+        self._misses = 0
+
+    @property
+    def hits(self) -> int:
+        """
+        :return: The number of requests served from the cache without asking Spotify.
+        """
+        return self._hits
+
+    @property
+    def revalidations(self) -> int:
+        """
+        :return: The number of expired entries Spotify confirmed as unchanged.
+        """
+        return self._revalidations
+
+    @property
+    def misses(self) -> int:
+        """
+        :return: The number of requests that had to fetch the full response.
+        """
+        return self._misses
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        :return: The share of requests served without asking Spotify, 0.0 if there were none.
+        """
+        total: int = self._hits + self._revalidations + self._misses
+        return self._hits / total if total else 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(kind: str, spotify_id: str) -> str:
+        return f"{kind}:{spotify_id}"
+
+    def _is_fresh(self, kind: str, entry: SpotifyCacheEntry) -> bool:
+        return time() - entry.cached_at < self._ttl[kind]
+
+    def _store(self, entry: SpotifyCacheEntry) -> None:
+        self._entries[entry.key] = entry
+        self._entries.move_to_end(entry.key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def _persist(self, entry: SpotifyCacheEntry) -> None:
+        """
+        Writes an entry to the database in the background, the caller does not wait for the write.
+
+        :param entry: The entry to persist.
+        :return: None
+        """
+
+        if self._database is None:
+            return
+
+        self._pending[entry.key] = entry
+        if self._flush_task is None:
+            self._flush_task = get_running_loop().create_task(self._flush())
+
+    async def _flush(self) -> None:
+        """
+        Writes all pending entries in a single transaction, once the current callers yielded.
+        :return: None
+        """
+
+        await sleep(0)
+        entries: list[SpotifyCacheEntry] = list(self._pending.values())
+        self._pending = {}
+        self._flush_task = None  # Entries set from now on are written by the next flush
+
+        try:
+            await self._database.set_spotify_cache_entries(entries)
+        except Error as e:
+            log(f"Failed to persist Spotify cache entries: {e}", error=True)
+
+    async def get(self, kind: str, spotify_id: str, stale: bool = False) -> SpotifyCacheEntry | None:
+        """
+        Gets a cached response. Fresh hits are counted.
+
+        :param kind: The kind of the object, e.g. ``track``.
+        :param spotify_id: The Spotify ID of the object.
+        :param stale: Whether expired entries may be returned, e.g. to revalidate them.
+        :return: The entry or None if not cached or expired.
+        """
+
+        key: str = self._key(kind, spotify_id)
+        if (entry := self._entries.get(key)) is None and self._database is not None:
+            if entry := await self._database.get_spotify_cache_entry(key):
+                self._store(entry)
+        if entry is None:
+            return None
+
+        self._entries.move_to_end(key)
+        if self._is_fresh(kind, entry):
+            if not stale:
+                self._hits += 1
+            return entry
+        return entry if stale else None
+
+    async def get_many(self, kind: str, spotify_ids: list[str]) -> dict[str, SpotifyCacheEntry]:
+        """
+        Gets several fresh cached responses. Entries not in memory are read from the database at once.
+        Fresh hits are counted.
+
+        :param kind: The kind of the objects, e.g. ``track``.
+        :param spotify_ids: The Spotify IDs of the objects.
+        :return: The fresh entries by Spotify ID, IDs that are not cached or expired are left out.
+        """
+
+        keys: dict[str, str] = {self._key(kind, spotify_id): spotify_id for spotify_id in spotify_ids}
+        loaded: dict[str, SpotifyCacheEntry] = {}
+        if self._database is not None and (unknown := [key for key in keys if key not in self._entries]):
+            loaded = await self._database.get_spotify_cache_entries(unknown)
+            for entry in loaded.values():
+                self._store(entry)
+
+        entries: dict[str, SpotifyCacheEntry] = {}
+        for key, spotify_id in keys.items():
+            entry: SpotifyCacheEntry | None = self._entries.get(key) or loaded.get(key)
+            if entry is None or not self._is_fresh(kind, entry):
+                continue
+
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._hits += 1
+            entries[spotify_id] = entry
+        return entries
+
+    def set(self, kind: str, spotify_id: str, data: dict, etag: str | None = None) -> None:
+        """
+        Caches a freshly fetched response.
+
+        :param kind: The kind of the object, e.g. ``track``.
+        :param spotify_id: The Spotify ID of the object.
+        :param data: The response of the Spotify API.
+        :param etag: The ETag of the response, if any.
+        :return: None
+        """
+
+        entry: SpotifyCacheEntry = SpotifyCacheEntry(self._key(kind, spotify_id), data, etag, int(time()))
+        self._misses += 1
+        self._store(entry)
+        self._persist(entry)
+
+    def touch(self, entry: SpotifyCacheEntry) -> None:
+        """
+        Marks an expired entry as unchanged, so it is fresh again.
+
+        :param entry: The revalidated entry.
+        :return: None
+        """
+
+        entry.cached_at = int(time())
+        self._revalidations += 1
+        self._store(entry)
+        self._persist(entry)
@@ -23,6 +23,17 @@ class TrackCollection:
             self.tracks = [Track(track) for track in data["tracks"]]
             self.total = len(self.tracks)
 
+    @classmethod
+    def from_tracks(cls, tracks: list[Track]) -> Self:
+        """
+        :param tracks: The tracks of the collection.
+        :return: A collection of already loaded tracks.
+        """
+        collection: Self = cls.__new__(cls)
+        collection.tracks = tracks
+        collection.total = len(tracks)
+        return collection
+
     def __len__(self) -> int:
         return len(self.tracks)
 
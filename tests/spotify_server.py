@@ -0,0 +1,91 @@
+"""
+A local stand-in for the Spotify accounts service and Web API, used by the Spotify tests and benchmarks.
+"""
+
+from asyncio import sleep
+from typing import Self
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from benchmarks.song_memory import spotify_track
+from lib.spotify.api import SpotifyAPI
+from lib.spotify.cache import SpotifyCache
+
+
+class FakeSpotify:
+    """
+    Serves tokens, tracks and playlists on localhost and counts the requests it answers.
+    Playlists carry an ETag and are answered with 304 Not Modified while it matches.
+    """
+
+    def __init__(self, token_delay: float = 0.0, latency: float = 0.0, expires_in: int = 3600) -> None:
+        self.token_delay = token_delay  # Seconds a token request takes
+        self.latency = latency  # Seconds every API request takes
+        self.expires_in = expires_in
+        self.playlist_version = 1  # Bumped to change the playlist
+
+        self.token_requests = 0
+        self.authorizations: list[str] = []  # Authorization header of each API request
+        self.playlist_downloads = 0
+        self.not_modified = 0
+
+        app: web.Application = web.Application()
+        app.router.add_post("/api/token", self._token)
+        app.router.add_get("/v1/tracks/{id}", self._track)
+        app.router.add_get("/v1/playlists/{id}", self._playlist)
+        self.server = TestServer(app)
+
+    async def __aenter__(self) -> Self:
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.server.close()
+
+    def client(self, cache: SpotifyCache | None = None) -> SpotifyAPI:
+        """
+        :param cache: The cache of the client.
+        :return: A client sending its requests to this server.
+        """
+
+        api: SpotifyAPI = SpotifyAPI("client-id", "client-secret", cache=cache)
+        api.API_URL = str(self.server.make_url("/v1"))
+        api.TOKEN_URL = str(self.server.make_url("/api/token"))
+        return api
+
+    async def _token(self, _: web.Request) -> web.Response:
+        self.token_requests += 1
+        token: str = f"token-{self.token_requests}"
+        await sleep(self.token_delay)
+        return web.json_response({"access_token": token, "token_type": "Bearer", "expires_in": self.expires_in})
+
+    async def _authorize(self, request: web.Request) -> None:
+        self.authorizations.append(request.headers.get("Authorization", ""))
+        if not request.headers.get("Authorization", "").startswith("Bearer token-"):
+            raise web.HTTPUnauthorized()
+        await sleep(self.latency)
+
+    async def _track(self, request: web.Request) -> web.Response:
+        await self._authorize(request)
+        return web.json_response(spotify_track(int(request.match_info["id"])))
+
+    async def _playlist(self, request: web.Request) -> web.Response:
+        await self._authorize(request)
+        etag: str = f'"{self.playlist_version}"'
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+
+        self.playlist_downloads += 1
+        tracks: list[dict] = [spotify_track(i) for i in range(self.playlist_version)]
+        return web.json_response(
+            {
+                "id": request.match_info["id"],
+                "name": f"Playlist version {self.playlist_version}",
+                "external_urls": {"spotify": f"https://open.spotify.com/playlist/{request.match_info['id']}"},
+                "snapshot_id": str(self.playlist_version),
+                "tracks": {"items": [{"track": track} for track in tracks], "total": len(tracks)}
+            },
+            headers={"ETag": etag}
+        )
@@ -0,0 +1,34 @@
+from asyncio import run
+from pathlib import Path
+from time import time
+
+from benchmarks.leveling import open_database
+from lib.db.database import Database
+from lib.db.db_classes import TrackResolution
+
+DAY = 24 * 60 * 60
+
+
+def test_outdated_track_resolutions_are_purged_on_startup(tmp_path: Path) -> None:
+    path: Path = tmp_path / "database.sqlite"
+
+    async def main() -> tuple[list[str], TrackResolution | None]:
+        database: Database = await open_database(path)
+        for spotify_id, age in (("fresh", DAY), ("outdated", 8 * DAY)):
+            await database.set_track_resolution(TrackResolution(
+                spotify_id, f"https://www.youtube.com/watch?v={spotify_id}", {}, int(time()) - age
+            ))
+        await database.close()
+
+        database = await open_database(path, resolution_ttl=7 * DAY)
+        try:
+            async with database._read() as db, db.execute("SELECT spotifyId FROM TrackResolutions;") as cursor:
+                remaining: list[str] = [row[0] for row in await cursor.fetchall()]
+            fresh: TrackResolution | None = await database.get_track_resolution("fresh", 7 * DAY)
+        finally:
+            await database.close()
+        return remaining, fresh
+
+    remaining, fresh = run(main())
+    assert remaining == ["fresh"]
+    assert fresh is not None and fresh.url == "https://www.youtube.com/watch?v=fresh"
@@ -0,0 +1,144 @@
+import os
+import stat
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Iterator
+
+from pytest import MonkeyPatch, fixture, mark
+
+from discord import FFmpegOpusAudio, PCMVolumeTransformer
+
+from config.settings import SETTINGS
+from lib.music.extraction import YTDLSource
+from lib.music.song import Song
+
+pytestmark = mark.skipif(not Path("/proc").is_dir(), reason="Child processes are counted through /proc")
+
+
+def _children() -> int:
+    """
+    :return: The number of running child processes of the test process.
+    """
+
+    count: int = 0
+    for stat_file in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # pid (comm) state ppid ..., comm may contain spaces
+            state, ppid = stat_file.read_text().rsplit(")", 1)[1].split()[:2]
+        except (OSError, IndexError, ValueError):
+            continue
+        if int(ppid) == os.getpid() and state != "Z":
+            count += 1
+    return count
+
+
+@fixture
+def stub_ffmpeg(tmp_path: Path, monkeypatch) -> None:
+    """Puts an ffmpeg on PATH that streams silence until it is killed."""
+
+    ffmpeg: Path = tmp_path / "ffmpeg"
+    ffmpeg.write_text("#!/bin/sh\nexec cat /dev/zero\n")
+    ffmpeg.chmod(ffmpeg.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+
+@fixture
+def source(stub_ffmpeg) -> Iterator[YTDLSource]:
+    requester = SimpleNamespace(id=1, guild=SimpleNamespace(id=1))
+    source: YTDLSource = YTDLSource(requester, data={
+        'title': "Title",
+        'uploader': "Uploader",
+        'webpage_url': "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        'url': "https://rr1---sn.googlevideo.com/videoplayback?expire=4102444800",
+        'duration': 213
+    })
+    source._opus = False  # PCM is the default, independent of the settings of the machine running the tests
+    yield source
+    source.cleanup()
+
+
+def test_construction_starts_no_process(source: YTDLSource) -> None:
+    assert source.original is None
+    assert _children() == 0
+
+
+def test_prefetched_song_starts_no_process(source: YTDLSource) -> None:
+    song: Song = Song(source)
+    assert song.resolved
+    assert _children() == 0
+
+
+def test_first_read_starts_one_process(source: YTDLSource) -> None:
+    assert source.read()
+    assert _children() == 1
+    source.read()
+    assert _children() == 1
+
+
+def test_cleanup_stops_the_process(source: YTDLSource) -> None:
+    source.read()
+    source.cleanup()
+    assert source.original is None
+    assert _children() == 0
+
+
+def test_reset_stops_the_process_and_a_read_restarts_it(source: YTDLSource) -> None:
+    source.read()
+    source.reset()
+    assert _children() == 0
+
+    assert source.read()
+    assert _children() == 1
+
+
+def _codec_source(monkeypatch: MonkeyPatch, acodec: str, volume: float, passthrough: bool = True) -> YTDLSource:
+    monkeypatch.setitem(SETTINGS['Music'], 'OpusPassthrough', passthrough)
+    return YTDLSource(SimpleNamespace(id=1, guild=SimpleNamespace(id=1)), volume=volume, data={
+        'title': "Title",
+        'webpage_url': "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        'url': "https://rr1---sn.googlevideo.com/videoplayback?expire=4102444800",
+        'acodec': acodec
+    })
+
+
+def _started(source: YTDLSource) -> tuple[type, list[str]]:
+    """
+    :return: The type of the started audio source and the arguments ffmpeg was started with.
+    """
+
+    original = source._create_source()
+    try:
+        ffmpeg = original.original if isinstance(original, PCMVolumeTransformer) else original
+        return type(original), ffmpeg._process.args
+    finally:
+        original.cleanup()
+
+
+def test_opus_stream_at_full_volume_is_copied(stub_ffmpeg, monkeypatch: MonkeyPatch) -> None:
+    source: YTDLSource = _codec_source(monkeypatch, 'opus', 1.0)
+    assert source.is_opus() and source.passthrough
+
+    started, args = _started(source)
+    assert started is FFmpegOpusAudio
+    assert args[args.index("-c:a") + 1] == "copy"
+    assert "-af" not in args
+
+
+def test_opus_stream_at_lower_volume_is_encoded_by_ffmpeg(stub_ffmpeg, monkeypatch: MonkeyPatch) -> None:
+    source: YTDLSource = _codec_source(monkeypatch, 'opus', 0.5)
+    assert source.is_opus() and not source.passthrough
+
+    started, args = _started(source)
+    assert started is FFmpegOpusAudio
+    assert args[args.index("-c:a") + 1] == "libopus"
+    assert args[args.index("-af") + 1] == "volume=0.5"
+
+
+@mark.parametrize(("acodec", "passthrough"), [('mp4a.40.2', True), (None, True), ('opus', False)])
+def test_other_codecs_fall_back_to_pcm(stub_ffmpeg, monkeypatch: MonkeyPatch, acodec: str, passthrough: bool) -> None:
+    source: YTDLSource = _codec_source(monkeypatch, acodec, 1.0, passthrough)
+    assert not source.is_opus() and not source.passthrough
+
+    started, args = _started(source)
+    assert started is PCMVolumeTransformer
+    assert args[args.index("-f") + 1] == "s16le"
@@ -0,0 +1,89 @@
+from numpy import allclose
+from pytest import mark
+
+from benchmarks.matching import QUERY, SCORERS, ComprehensionScorer, per_search, search_results
+from lib.music.matching import MatchScorer
+
+
+def _result(title: str, channel: str, duration: int | None) -> dict:
+    return {'title': title, 'channel': channel, 'duration': duration}
+
+
+# Searched track (title, artist, duration) and offline search results, with the index of the correct result
+CASES = [
+    (("Bohemian Rhapsody", "Queen", 354), [
+        _result("Queen – Bohemian Rhapsody (Live Aid 1985)", "Queen Official", 362),
+        _result("Queen – Bohemian Rhapsody (Official Video Remastered)", "Queen Official", 359),
+        _result("Bohemian Rhapsody 1 Hour Loop", "Loop Station", 3600),
+    ], 1),
+    (("Blinding Lights", "The Weeknd", 200), [
+        _result("The Weeknd - Blinding Lights (Slowed + Reverb)", "slowed vibes", 241),
+        _result("The Weeknd - Blinding Lights (Official Audio)", "The Weeknd", 202),
+        _result("Blinding Lights Reaction", "Reacts Daily", 612),
+    ], 1),
+    (("Hello", "Adele", 295), [
+        _result("Lionel Richie - Hello", "LionelRichieVEVO", 330),
+        _result("Adele - Hello (Official Music Video)", "Adele", 367),
+        _result("Hello", "Adele - Topic", 296),
+    ], 2),
+    (("Yesterday - Remastered 2009", "The Beatles", 125), [
+        _result("Yesterday (Remastered 2009)", "The Beatles - Topic", 126),
+        _result("Yesterday - The Beatles (Acoustic Cover)", "Guitar Covers", 131),
+        _result("The Beatles - Yesterday (Live)", "Beatles Archive", 170),
+    ], 0),
+    (("Smells Like Teen Spirit", "Nirvana", 301), [
+        _result("Nirvana - Smells Like Teen Spirit (Live at Reading 1992)", "Nirvana", 300),
+        _result("Nirvana - Smells Like Teen Spirit (Official Music Video)", "Nirvana", 279),
+        _result("Smells Like Teen Spirit (Karaoke)", "Sing King", 301),
+    ], 1),
+    (("Shape of You", "Ed Sheeran", 233), [
+        _result("Shape of You - Ed Sheeran (Karaoke Version)", "Sing King", 235),
+        _result("Ed Sheeran - Shape of You (Official Music Video)", "Ed Sheeran", 263),
+        _result("Ed Sheeran - Shape of You [Official Audio]", "Ed Sheeran", 234),
+    ], 2),
+    (("Levitating", "Dua Lipa, DaBaby", 203), [
+        _result("Levitating (Instrumental)", "Karaoke Hits", 203),
+        _result("Dua Lipa - Levitating Featuring DaBaby (Official Music Video)", "Dua Lipa", 231),
+        _result("Levitating", "Dua Lipa - Topic", 204),
+    ], 2),
+    (("never gonna give you up rick astley", None, None), [
+        _result("Rick Astley - Never Gonna Give You Up (Official Music Video)", "Rick Astley", 213),
+        _result("Never Gonna Give You Up but it's a 10 hour loop", "Memes", 36000),
+        _result("Rick Astley - Never Gonna Give You Up (Live)", "Rick Astley", 230),
+    ], 0),
+]
+
+
+@mark.parametrize(("query", "results", "expected"), CASES)
+def test_best_match(query: tuple[str, str | None, int | None], results: list[dict], expected: int) -> None:
+    assert MatchScorer(*query).best(results) is results[expected]
+
+
+def test_accuracy_beats_first_result() -> None:
+    """The scorer should pick the correct result more often than taking the first one, as before."""
+
+    scored: int = sum(MatchScorer(*query).best(results) is results[expected] for query, results, expected in CASES)
+    first: int = sum(expected == 0 for _, _, expected in CASES)
+    assert scored == len(CASES)
+    assert first < scored
+
+
+def test_scores_are_normalized() -> None:
+    scores = MatchScorer("Hello", "Adele", 295).score(CASES[2][1])
+    assert ((scores >= 0) & (scores <= 1)).all()
+
+
+@mark.parametrize("count", [0, 1, 50])
+def test_scores_match_comprehension_scorer(count: int) -> None:
+    results: list[dict] = search_results(count)
+    for query in (QUERY, *(query for query, _, _ in CASES)):
+        assert allclose(MatchScorer(*query).score(results), ComprehensionScorer(*query).score(results))
+
+
+def test_ranking_speed() -> None:
+    """Ranking many results should stay well ahead of the previous scorer and not fall behind the comprehensions."""
+
+    results: list[dict] = search_results(500)
+    vectorized: float = per_search(SCORERS["MatchScorer, vectorized"], results, rounds=10)
+    assert vectorized < per_search(SCORERS["SequenceMatcher (previous)"], results, rounds=2) / 3
+    assert vectorized < per_search(SCORERS["MatchScorer, comprehensions"], results, rounds=10) * 1.5
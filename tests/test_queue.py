@@ -0,0 +1,96 @@
+from collections import Counter
+from random import Random
+from types import SimpleNamespace
+
+from pytest import MonkeyPatch, fixture, mark
+
+from lib.music.queue import SongQueue, _IndexedList
+
+
+def _song(i: int) -> SimpleNamespace:
+    """A stand-in song, some share a URL for dedupe and some have no duration."""
+    return SimpleNamespace(
+        url=f"https://example.com/{i % 40}", duration=i % 7 * 30, requester=SimpleNamespace(id=i % 3)
+    )
+
+
+@fixture(autouse=True)
+def small_chunks(monkeypatch: MonkeyPatch) -> None:
+    """Small chunks, so a few dozen songs already split and empty chunks."""
+    monkeypatch.setattr(_IndexedList, "CHUNK_SIZE", 4)
+
+
+@mark.parametrize("seed", range(5))
+def test_indexed_list_matches_list(seed: int) -> None:
+    rng: Random = Random(seed)
+    indexed: _IndexedList = _IndexedList()
+    expected: list = []
+    created: int = 0
+
+    for _ in range(2000):
+        operation: int = rng.randrange(9)
+        if operation <= 2 or not expected:
+            created += 1
+            index: int = rng.randint(-len(expected) - 2, len(expected) + 2)
+            indexed.insert(index, created)
+            expected.insert(index, created)
+        elif operation == 3:
+            index = rng.randrange(-len(expected), len(expected))
+            assert indexed.pop(index) == expected.pop(index)
+        elif operation == 4:
+            index = rng.randrange(-len(expected), len(expected))
+            created += 1
+            indexed[index] = expected[index] = created
+        elif operation == 5:
+            start, stop = rng.randint(-5, len(expected) + 5), rng.randint(-5, len(expected) + 5)
+            assert indexed.slice(start, stop) == expected[start:stop]
+            assert indexed.slice(start, None, 2) == expected[start::2]
+        elif operation == 6:
+            items: list[int] = list(range(created + 1, created + rng.randint(0, 9) + 1))
+            created += len(items)
+            indexed.extend(items)
+            expected.extend(items)
+        elif operation == 7:
+            indexed.reverse()
+            expected.reverse()
+        else:
+            assert indexed.popleft() == expected.pop(0)
+
+        assert len(indexed) == len(expected)
+        if expected:
+            index = rng.randrange(-len(expected), len(expected))
+            assert indexed[index] == expected[index]
+
+    assert list(indexed) == expected
+
+
+@mark.parametrize("seed", range(5))
+def test_song_queue_keeps_totals(seed: int) -> None:
+    rng: Random = Random(seed)
+    queue: SongQueue = SongQueue()
+    created: int = 0
+
+    for _ in range(500):
+        operation: int = rng.randrange(8)
+        if operation <= 2 or not len(queue):
+            created += 1
+            queue.insert(rng.randint(0, len(queue)), _song(created))
+        elif operation == 3:
+            del queue[rng.randrange(len(queue))]
+        elif operation == 4:
+            queue.move(rng.randrange(len(queue)), rng.randrange(len(queue)))
+        elif operation == 5:
+            start: int = rng.randrange(len(queue))
+            queue.remove_range(start, start + rng.randint(0, 5))
+        elif operation == 6:
+            songs: list[SimpleNamespace] = [_song(created + i + 1) for i in range(rng.randint(1, 9))]
+            created += len(songs)
+            queue.extend(songs)
+        elif rng.random() < 0.2:
+            queue.dedupe()
+        else:
+            queue.shuffle()
+
+        assert queue.duration == sum(song.duration for song in queue)
+        requesters: Counter[int] = Counter(song.requester.id for song in queue)
+        assert all(queue.count(requester) == requesters[requester] for requester in range(3))
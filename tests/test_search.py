@@ -0,0 +1,43 @@
+from asyncio import gather, get_running_loop, run
+
+from pytest import mark
+
+from benchmarks.extraction import load_fixtures, replayed, search_to_playable
+from benchmarks.song_memory import REQUESTER
+from lib.music.extraction import YTDLSource
+
+
+@mark.parametrize(("single_pass", "jobs"), [(True, 1), (False, 2)])
+def test_extraction_jobs_per_song(single_pass: bool, jobs: int) -> None:
+    fixtures: dict = load_fixtures()
+    with replayed(fixtures, single_pass, scale=0) as (ytdl, executor):
+        timings: list[float] = run(search_to_playable(fixtures['tracks']))
+
+        assert len(timings) == len(fixtures['tracks'])
+        assert executor._dispatched == jobs * len(fixtures['tracks'])
+        assert ytdl.fetches == 2 * len(fixtures['tracks'])  # The search page and the page of the best match
+
+
+def test_both_paths_pick_the_same_match() -> None:
+    fixtures: dict = load_fixtures()
+
+    async def resolve() -> list[str]:
+        sources: list[YTDLSource] = await gather(*(
+            YTDLSource.from_spotify(
+                REQUESTER, "", track['name'], track['artists'], track['duration'], get_running_loop()
+            )
+            for track in fixtures['tracks']
+        ))
+        assert all(source.stream_url.startswith("https://") for source in sources)
+        return [source.url for source in sources]
+
+    picked: dict[bool, list[str]] = {}
+    for single_pass in (True, False):
+        with replayed(fixtures, single_pass, scale=0):
+            picked[single_pass] = run(resolve())
+
+    assert picked[True] == picked[False]
+    assert [fixtures['videos'][url]['info']['title'] for url in picked[True]] == [
+        "Bohemian Rhapsody (Remastered 2011)", "Blinding Lights", "Hello", "Smells Like Teen Spirit",
+        "Levitating (feat. DaBaby)", "Never Gonna Give You Up"
+    ]
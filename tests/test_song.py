@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+from benchmarks.song_memory import REQUESTER, info_dict, retained, spotify_track, _FullEntry
+from lib.music.extraction import YTDLSource
+from lib.music.search_query import SearchQuery
+from lib.music.song import Song
+from lib.spotify.track import Track
+
+
+def test_spotify_song_keeps_only_the_compact_entry() -> None:
+    song: Song = Song(Track(spotify_track(1)), REQUESTER)
+
+    assert not song.resolved
+    assert song.source is None
+    assert song.title == "Song Title Number 1"
+    assert song.artist == "Artist 1, Featured 1"
+    assert song.url == f"https://open.spotify.com/track/{1:022d}"
+    assert song.duration == 215
+
+
+def test_search_song_without_artist() -> None:
+    song: Song = Song(SearchQuery("never gonna give you up"), SimpleNamespace(id=1))
+
+    assert song.artist == "Unknown Artist"
+    assert song.duration == 0
+    assert song.url.startswith("https://music.youtube.com/search?q=never%20gonna")
+
+
+def test_released_url_song_can_be_found_again() -> None:
+    source: YTDLSource = YTDLSource(REQUESTER, data=info_dict(1))
+    song: Song = Song(source)
+    song.release()
+
+    assert not song.resolved
+    assert song.title == source.name
+    assert song.artist == source.artist
+    assert song.url == source.url
+    assert song.duration == 215
+
+
+def test_detached_copy_has_no_source() -> None:
+    song: Song = Song(YTDLSource(REQUESTER, data=info_dict(1)))
+    copy: Song = song.detached()
+
+    assert song.resolved
+    assert not copy.resolved
+    assert copy is not song and copy == song
+
+
+def test_compact_entries_of_10k_songs_use_a_fraction_of_the_full_objects() -> None:
+    full: float = retained(lambda i: _FullEntry(Track(spotify_track(i)), REQUESTER))
+    compact: float = retained(lambda i: Song(Track(spotify_track(i)), REQUESTER))
+
+    assert compact < full / 3
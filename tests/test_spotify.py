@@ -0,0 +1,67 @@
+from asyncio import gather, run
+from datetime import datetime, timedelta
+
+from lib.spotify.cache import SpotifyCache
+from lib.spotify.playlist import Playlist
+from lib.spotify.track import Track
+from tests.spotify_server import FakeSpotify
+
+
+def test_concurrent_requests_share_one_token_refresh() -> None:
+    async def main() -> None:
+        async with FakeSpotify(token_delay=0.05) as server:
+            api = server.client()
+            try:
+                tracks: list[Track] = await gather(*(api.get_track(str(i)) for i in range(20)))
+            finally:
+                await api.close()
+
+        assert [track.name for track in tracks] == [f"Song Title Number {i}" for i in range(20)]
+        assert server.token_requests == 1
+        assert set(server.authorizations) == {"Bearer token-1"}
+        assert api.token_refresh_latency >= 0.05
+
+    run(main())
+
+
+def test_token_is_renewed_in_the_background_before_it_expires() -> None:
+    async def main() -> None:
+        async with FakeSpotify(token_delay=0.05) as server:
+            api = server.client()
+            try:
+                await api.get_track("1")
+                api._token_expiry = datetime.now() + timedelta(seconds=api.TOKEN_REFRESH_MARGIN / 2)
+
+                # Requests keep using the current token while the new one is fetched
+                await gather(*(api.get_track(str(i)) for i in range(5)))
+                assert server.authorizations[1:] == ["Bearer token-1"] * 5
+                await api._token_task
+                await api.get_track("1")
+            finally:
+                await api.close()
+
+        assert server.token_requests == 2
+        assert server.authorizations[-1] == "Bearer token-2"
+
+    run(main())
+
+
+def test_expired_playlist_is_revalidated_by_etag() -> None:
+    async def main() -> None:
+        async with FakeSpotify() as server:
+            cache: SpotifyCache = SpotifyCache(ttl={"playlist": 0})
+            api = server.client(cache)
+            try:
+                first: Playlist = await api.get_playlist("37i9dQZF1DXcBWIGoYBM5M")
+                unchanged: Playlist = await api.get_playlist("37i9dQZF1DXcBWIGoYBM5M")
+                server.playlist_version += 1
+                changed: Playlist = await api.get_playlist("37i9dQZF1DXcBWIGoYBM5M")
+            finally:
+                await api.close()
+
+        assert unchanged == first and len(unchanged) == 1
+        assert changed.name == "Playlist version 2" and len(changed) == 2
+        assert server.playlist_downloads == 2 and server.not_modified == 1
+        assert (cache.misses, cache.revalidations) == (2, 1)
+
+    run(main())